@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# Runs kaslan commands against the fake vCenter and compares them with baseline.json
+#
+#   python benchmarks/bench.py                    # run and check against the baseline
+#   python benchmarks/bench.py --latency 0.02     # add 20ms to every SOAP call
+#   python benchmarks/bench.py --update-baseline  # store the current numbers
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+import json
+import os
+import shutil
+import ssl
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+# The fake vCenter uses a self-signed certificate
+if hasattr(ssl, '_create_unverified_context'):
+    ssl._create_default_https_context = ssl._create_unverified_context
+
+import fake_vcenter
+import kaslan.commands
+from kaslan import cli
+from kaslan.inventory import InventoryIndex
+from kaslan.vmware import VMware
+
+BASELINE = join(dirname(abspath(__file__)), 'baseline.json')
+
+# Mixed batch for input, clones and status lookups
+INPUT_LINES = [
+    'clone RHEL7 bench{0:02d} --ip 10.200.0.{0} --ds_prefix ds --force'.format(n) for n in range(1, 9)
+] + [
+    'status vm{:05d}'.format(n) for n in range(0, 800, 100)
+]
+
+# Name, kaslan command line, lines written to a file for batches and VMware options
+CASES = (
+    ('status', ['status', 'vm00042']),
+    ('status-fleet', ['status', 'vm001*']),
+    ('status-folder', ['status', '--folder', 'Linux/Inbox']),
+    ('compute', ['compute', 'vm00042']),
+    ('compute-set', ['compute', 'vm00042', '-c', '4', '-m', '8']),
+    ('datastore', ['datastore', 'Cluster1', '--prefix', 'ds']),
+    ('datastore-summary', ['datastore', 'Cluster1', '--summary']),
+    ('clone', ['clone', 'RHEL7', 'bench00', '--ip', '10.200.0.10', '--ds_prefix', 'ds', '--force']),
+    ('input', ['input', '--parallel', '4'], INPUT_LINES),
+    ('input-sessions', ['input', '--parallel', '4'], INPUT_LINES, {'sessions': 4}),
+)
+
+# Allowed growth over the baseline, task monitor waits are not checked
+CALLS_TOLERANCE = 0.02
+BYTES_TOLERANCE = 0.10
+TIME_TOLERANCE = 0.50
+
+
+def get_config(port, cache_dir):
+    return {
+        'vcenter_host': '127.0.0.1',
+        'vcenter_port': port,
+        'defaults': {
+            'cpus': 1,
+            'memory_gb': 2,
+            'datacenter': 'DC',
+            'cluster': 'Cluster1',
+            'domain': 'example.com',
+            'folder': 'Linux/Inbox',
+            'ds_prov_limit': 95,
+            'ds_vm_limit': 10000,
+            'clone_mode': 'full',
+        },
+        'networks': {
+            '10.200.0.0/24': {'gateway': '10.200.0.1', 'dns': '10.200.0.2', 'vlan': 100},
+        },
+        'templates': {'RHEL7': 'RHEL 7.1'},
+        'cache_dir': cache_dir,
+        'inventory_cache': True,
+    }
+
+
+# One case on a fresh inventory and cache, connect counts since every CLI run pays for it
+def run_case(case, opts):
+    name, argv = case[:2]
+    lines = case[2] if len(case) > 2 else None
+    options = dict(case[3] if len(case) > 3 else {}, compression=not opts.no_compression)
+    server = fake_vcenter.serve(
+        fake_vcenter.FakeVCenter(fake_vcenter.build_inventory(vms=opts.vms), task_seconds=opts.task_seconds),
+        latency=opts.latency
+    )
+    cache_dir = tempfile.mkdtemp(prefix='kaslan-bench-')
+    port = server.server_address[1]
+    config = get_config(port, cache_dir)
+    if lines:
+        lines_path = join(cache_dir, 'input.txt')
+        with open(lines_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        argv = argv + [lines_path]
+
+    parser = cli.get_parser(config)
+    args = parser.parse_args(['--no-daemon'] + argv)
+    stdout = sys.stdout
+    start = time.time()
+    try:
+        kaslan.commands._vmware = VMware(
+            '127.0.0.1', port, 'bench', 'bench',
+            page_size=opts.page_size,
+            index=InventoryIndex('127.0.0.1', cache_dir),
+            **options
+        )
+        if not opts.verbose:
+            sys.stdout = open(os.devnull, 'w')
+        cli.run(parser, args, config)
+        error = None
+    except SystemExit as e:
+        error = e.code and 'exit {}'.format(e.code)
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+    finally:
+        sys.stdout = stdout
+        seconds = time.time() - start
+        vmware, kaslan.commands._vmware = kaslan.commands._vmware, None
+        if vmware:
+            vmware.disconnect()
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return {
+        'seconds': round(seconds, 3),
+        'calls': server.stats['calls'],
+        'waits': server.stats['waits'],
+        'bytes': server.stats['bytes'],
+        'connections': server.stats['connections'],
+        'error': error,
+    }
+
+
+# Several runs of a case, a baseline keeps the worst counts while a check keeps the best
+def run_repeated(case, opts):
+    runs = [run_case(case, opts) for _ in range(opts.runs or (3 if opts.update_baseline else 1))]
+    pick = max if opts.update_baseline else min
+    result = dict((k, pick(r[k] for r in runs)) for k in ('calls', 'waits', 'bytes', 'connections'))
+    result['seconds'] = sorted(r['seconds'] for r in runs)[len(runs) // 2]
+    result['error'] = next((r['error'] for r in runs if r['error']), None)
+    return result
+
+
+# Returns the reasons result regressed against base
+def regressions(result, base, check_time):
+    found = []
+    if result['calls'] > base['calls'] * (1 + CALLS_TOLERANCE):
+        found.append('calls {} > {}'.format(result['calls'], base['calls']))
+    if result['bytes'] > base['bytes'] * (1 + BYTES_TOLERANCE):
+        found.append('bytes {} > {}'.format(result['bytes'], base['bytes']))
+    if check_time and result['seconds'] > base['seconds'] * (1 + TIME_TOLERANCE):
+        found.append('time {:.2f}s > {:.2f}s'.format(result['seconds'], base['seconds']))
+    return found
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark kaslan commands against a local fake vCenter')
+    parser.add_argument('cases', metavar='CASE', help='cases to run, default all', nargs='*')
+    parser.add_argument('--vms', metavar='N', type=int, help='VMs in the inventory', default=2000)
+    parser.add_argument('--latency', metavar='SECONDS', type=float, help='added to every SOAP call', default=0.0)
+    parser.add_argument('--task-seconds', dest='task_seconds', metavar='SECONDS', type=float, help='time until fake tasks finish', default=0.2)
+    parser.add_argument('--page-size', dest='page_size', metavar='N', type=int, help='kaslan retrieval page size', default=500)
+    parser.add_argument('--no-compression', dest='no_compression', help='ask for uncompressed responses', action='store_true', default=False)
+    parser.add_argument('--check-time', dest='check_time', help='also fail on wall time regressions', action='store_true', default=False)
+    parser.add_argument('--runs', metavar='N', type=int, help='runs per case, default 1 or 3 with --update-baseline')
+    parser.add_argument('--update-baseline', dest='update_baseline', help='store results as the new baseline', action='store_true', default=False)
+    parser.add_argument('--verbose', '-v', help='show command output', action='store_true', default=False)
+    opts = parser.parse_args()
+
+    cases = [c for c in CASES if not opts.cases or c[0] in opts.cases]
+    unknown = set(opts.cases) - set(c[0] for c in CASES)
+    if unknown:
+        parser.error('unknown cases: {}'.format(', '.join(sorted(unknown))))
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    print '{:<18} {:>8} {:>7} {:>7} {:>10} {:>7}  {}'.format('Case', 'Time', 'Calls', 'Waits', 'Bytes', 'Conns', 'Result')
+    results = {}
+    failed = 0
+    for case in cases:
+        result = results[case[0]] = run_repeated(case, opts)
+        problems = [result['error']] if result['error'] else []
+        if case[0] in baseline and not opts.update_baseline:
+            problems += regressions(result, baseline[case[0]], opts.check_time)
+        elif not opts.update_baseline:
+            problems.append('no baseline')
+        failed += bool(problems)
+        print '{:<18} {:>7.2f}s {:>7} {:>7} {:>10} {:>7}  {}'.format(
+            case[0], result['seconds'], result['calls'], result['waits'], result['bytes'], result['connections'],
+            '; '.join(problems) or 'ok'
+        )
+
+    if opts.update_baseline:
+        for name, result in results.iteritems():
+            if not result['error']:
+                baseline[name] = dict((k, result[k]) for k in ('seconds', 'calls', 'bytes'))
+        with open(BASELINE, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+        print 'Baseline written to {}'.format(BASELINE)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,888 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime
+from xml.parsers.expat import ParserCreate
+import SocketServer
+import gzip
+import itertools
+import re
+import os
+import StringIO
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+
+from pyVmomi import vim, vmodl, SoapAdapter, VmomiSupport
+
+VERSION = 'vim.version.version9'
+NAMESPACE = 'urn:vim25'
+
+VERSIONS_XML = '''<?xml version="1.0" encoding="UTF-8" ?>
+<namespaces version="1.0">
+ <namespace>
+  <name>urn:vim25</name>
+  <version>5.5</version>
+  <priorVersions><version>5.1</version><version>5.0</version><version>4.1</version><version>4.0</version></priorVersions>
+ </namespace>
+</namespaces>
+'''
+
+# Calls whose count depends on task timing
+TASK_MONITOR_METHODS = ('WaitForUpdatesEx', 'ModifyListView')
+
+# Properties that hold the objects inside a container, for container views and inventory paths
+CHILD_PROPS = ('childEntity', 'vmFolder', 'hostFolder', 'datastoreFolder', 'networkFolder', 'host', 'resourcePool', 'vm')
+
+
+class FakeObject(object):
+
+    def __init__(self, cls, moid, props):
+        self.cls = cls
+        self.moid = moid
+        self.props = props
+
+    @property
+    def ref(self):
+        return self.cls(self.moid)
+
+
+class Inventory(object):
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.RLock()
+        self.counter = itertools.count(1000)
+
+    def add(self, cls, moid, **props):
+        obj = FakeObject(cls, moid, props)
+        self.objects[moid] = obj
+        return obj
+
+    def new_moid(self, prefix):
+        return '{}-{}'.format(prefix, next(self.counter))
+
+    def get(self, ref):
+        return self.objects.get(getattr(ref, '_moId', ref))
+
+    # Stored values may be whole data objects, dotted paths read into them
+    def get_prop(self, obj, path):
+        if path in obj.props:
+            return True, obj.props[path]
+        parts = path.split('.')
+        for i in range(len(parts) - 1, 0, -1):
+            prefix = '.'.join(parts[:i])
+            if prefix in obj.props:
+                val = obj.props[prefix]
+                for part in parts[i:]:
+                    val = getattr(val, part, None)
+                    if val is None:
+                        return False, None
+                return True, val
+        return False, None
+
+    def children(self, obj):
+        refs = []
+        for name in CHILD_PROPS:
+            val = obj.props.get(name)
+            if val is None:
+                continue
+            refs.extend(val if isinstance(val, list) else [val])
+        return [self.objects[r._moId] for r in refs if r._moId in self.objects]
+
+    def contained(self, container, types, recursive):
+        found = []
+        seen = set([container.moid])
+        pending = [container]
+        while pending:
+            obj = pending.pop(0)
+            for child in self.children(obj):
+                if child.moid in seen:
+                    continue
+                seen.add(child.moid)
+                if not types or any(issubclass(child.cls, t) for t in types):
+                    found.append(child)
+                if recursive:
+                    pending.append(child)
+        return found
+
+    def view_contents(self, view):
+        if view.cls is vim.view.ListView:
+            return view.props['view']
+        container = self.objects[view.props['container']._moId]
+        objs = self.contained(container, view.props['type'], view.props['recursive'])
+        return [o.ref for o in objs]
+
+    def remove(self, moid):
+        self.objects.pop(moid, None)
+        for obj in self.objects.itervalues():
+            for name in ('vm', 'childEntity'):
+                val = obj.props.get(name)
+                if isinstance(val, list):
+                    obj.props[name] = ref_list([r for r in val if r._moId != moid])
+
+
+def ref_list(refs, cls=vim.ManagedObject):
+    return cls.Array(refs)
+
+
+# Scripted inventory: one datacenter, clusters of hosts, datastores, DV portgroups, folders and VMs
+def build_inventory(vms=1000, hosts=8, clusters=2, datastores=20, portgroups=50, folders=20, templates=('RHEL 7.1', )):
+    inv = Inventory()
+    now = datetime(2015, 1, 1)
+
+    root = inv.add(vim.Folder, 'group-d1', name='Datacenters', childEntity=ref_list([]))
+    vm_folder = inv.add(vim.Folder, 'group-v3', name='vm', childEntity=ref_list([]))
+    host_folder = inv.add(vim.Folder, 'group-h4', name='host', childEntity=ref_list([]))
+    ds_folder = inv.add(vim.Folder, 'group-s5', name='datastore', childEntity=ref_list([]))
+    net_folder = inv.add(vim.Folder, 'group-n6', name='network', childEntity=ref_list([]))
+    dc = inv.add(
+        vim.Datacenter, 'datacenter-2',
+        name='DC', parent=root.ref,
+        vmFolder=vm_folder.ref, hostFolder=host_folder.ref, datastoreFolder=ds_folder.ref, networkFolder=net_folder.ref
+    )
+    root.props['childEntity'].append(dc.ref)
+    for f in (vm_folder, host_folder, ds_folder, net_folder):
+        f.props['parent'] = dc.ref
+
+    # VM folders, Linux/Inbox plus flat ones
+    def add_folder(name, parent):
+        folder = inv.add(vim.Folder, inv.new_moid('group-v'), name=name, parent=parent.ref, childEntity=ref_list([]))
+        parent.props['childEntity'].append(folder.ref)
+        return folder
+    linux = add_folder('Linux', vm_folder)
+    inbox = add_folder('Inbox', linux)
+    vm_folders = [inbox] + [add_folder('Folder{:02d}'.format(i), vm_folder) for i in range(folders)]
+
+    # Clusters with their root resource pool
+    cluster_objs = []
+    for i in range(clusters):
+        cluster = inv.add(
+            vim.ClusterComputeResource, 'domain-c{}'.format(10 + i),
+            name='Cluster{}'.format(i + 1), parent=host_folder.ref,
+            host=ref_list([]), datastore=ref_list([])
+        )
+        pool = inv.add(vim.ResourcePool, 'resgroup-{}'.format(20 + i), name='Resources', parent=cluster.ref, vm=ref_list([]))
+        cluster.props['resourcePool'] = pool.ref
+        host_folder.props['childEntity'].append(cluster.ref)
+        cluster_objs.append(cluster)
+
+    host_objs = []
+    for i in range(hosts):
+        cluster = cluster_objs[i % clusters]
+        host = inv.add(
+            vim.HostSystem, 'host-{}'.format(100 + i),
+            name='esx{:02d}.example.com'.format(i + 1), parent=cluster.ref,
+            **{'runtime.connectionState': 'connected', 'runtime.inMaintenanceMode': False}
+        )
+        cluster.props['host'].append(host.ref)
+        host_objs.append(host)
+
+    ds_objs = []
+    for i in range(datastores):
+        cluster = cluster_objs[i % clusters]
+        ds = inv.add(vim.Datastore, 'datastore-{}'.format(200 + i), name='ds{:02d}'.format(i + 1), parent=ds_folder.ref, vm=ref_list([]))
+        ds.props['summary'] = vim.Datastore.Summary(
+            name=ds.props['name'],
+            url='ds:///vmfs/volumes/{}/'.format(ds.moid),
+            capacity=4 * 1024 ** 4,
+            freeSpace=(2 + i % 3) * 512 * 1024 ** 3,
+            uncommitted=(i % 4) * 256 * 1024 ** 3,
+            type='VMFS',
+            accessible=True,
+            datastore=ds.ref,
+            multipleHostAccess=True
+        )
+        ds_folder.props['childEntity'].append(ds.ref)
+        cluster.props['datastore'].append(ds.ref)
+        ds_objs.append(ds)
+
+    dvs = inv.add(vim.dvs.VmwareDistributedVirtualSwitch, 'dvs-7', name='dvSwitch', parent=net_folder.ref, uuid='50 00 aa bb cc dd ee ff-00 11 22 33 44 55 66 77')
+    net_folder.props['childEntity'].append(dvs.ref)
+    for i in range(portgroups):
+        moid = 'dvportgroup-{}'.format(300 + i)
+        port_config = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy(
+            vlan=vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec(vlanId=100 + i, inherited=False)
+        )
+        pg = inv.add(
+            vim.dvs.DistributedVirtualPortgroup, moid,
+            name='VLAN{}'.format(100 + i), parent=net_folder.ref, key=moid,
+            host=ref_list([h.ref for h in host_objs]),
+            **{'config.defaultPortConfig': port_config, 'config.distributedVirtualSwitch': dvs.ref}
+        )
+        net_folder.props['childEntity'].append(pg.ref)
+
+    def add_vm(name, n, template=False):
+        cluster = cluster_objs[n % clusters]
+        pool = inv.objects[cluster.props['resourcePool']._moId]
+        host = host_objs[n % hosts]
+        ds = ds_objs[n % datastores]
+        folder = vm_folders[n % len(vm_folders)] if not template else vm_folder
+        nic = vim.vm.device.VirtualVmxnet3(
+            key=4000,
+            deviceInfo=vim.Description(label='Network adapter 1', summary='VM Network'),
+            backing=vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(deviceName='VM Network'),
+            macAddress='00:50:56:00:{:02x}:{:02x}'.format(n // 256 % 256, n % 256)
+        )
+        disk = vim.vm.device.VirtualDisk(
+            key=2000,
+            capacityInKB=16 * 1024 * 1024,
+            deviceInfo=vim.Description(label='Hard disk 1', summary='16,777,216 KB'),
+            backing=vim.vm.device.VirtualDisk.FlatVer2BackingInfo(
+                fileName='[{}] {}/{}.vmdk'.format(ds.props['name'], name, name),
+                diskMode='persistent',
+                thinProvisioned=True
+            )
+        )
+        vm = inv.add(
+            vim.VirtualMachine, inv.new_moid('vm'),
+            name=name, parent=folder.ref, resourcePool=pool.ref, snapshot=None,
+            datastore=ref_list([ds.ref]),
+            **{
+                'config.hardware.numCPU': 1 + n % 4,
+                'config.hardware.memoryMB': 1024 * (1 + n % 8),
+                'config.hardware.device': vim.vm.device.VirtualDevice.Array([nic, disk]),
+                'config.guestFullName': 'Red Hat Enterprise Linux 7 (64-bit)',
+                'config.version': 'vmx-10',
+                'config.template': template,
+                'guest.guestState': 'notRunning' if template else 'running',
+                'guest.toolsStatus': 'toolsNotRunning' if template else 'toolsOk',
+                'guest.ipAddress': None if template else '10.{}.{}.{}'.format(n // 65536 % 256, n // 256 % 256, n % 256),
+                'guest.hostName': None if template else '{}.example.com'.format(name),
+                'runtime.powerState': 'poweredOff' if template else 'poweredOn',
+                'runtime.bootTime': None if template else now,
+                'runtime.host': host.ref,
+                'summary.storage': vim.vm.Summary.StorageSummary(
+                    committed=8 * 1024 ** 3, uncommitted=8 * 1024 ** 3, unshared=8 * 1024 ** 3, timestamp=now
+                ),
+            }
+        )
+        folder.props['childEntity'].append(vm.ref)
+        pool.props['vm'].append(vm.ref)
+        ds.props['vm'].append(vm.ref)
+        return vm
+
+    for n, name in enumerate(templates):
+        add_vm(name, n, template=True)
+    for n in range(vms):
+        add_vm('vm{:05d}'.format(n), n)
+
+    return inv
+
+
+class RequestDeserializer(SoapAdapter.ExpatDeserializerNSHandlers):
+
+    def __init__(self):
+        SoapAdapter.ExpatDeserializerNSHandlers.__init__(self)
+        self.deser = SoapAdapter.SoapDeserializer(version=VERSION)
+
+    # Returns (method info, this, args by name)
+    def deserialize(self, data):
+        self.depth = 0
+        self.info = None
+        self.this = None
+        self.args = {}
+        self.pending = None
+        self.parser = ParserCreate(namespace_separator=SoapAdapter.NS_SEP)
+        self.parser.buffer_text = True
+        SoapAdapter.SetHandlers(self.parser, SoapAdapter.GetHandlers(self))
+        SoapAdapter.ReadDocument(self.parser, data)
+        self.collect()
+        return self.info, self.this, self.args
+
+    def collect(self):
+        if not self.pending:
+            return
+        name, is_list = self.pending
+        val = self.deser.GetResult()
+        if name == '_this':
+            self.this = val
+        elif is_list:
+            self.args.setdefault(name, []).append(val)
+        else:
+            self.args[name] = val
+        self.pending = None
+
+    def StartElementHandler(self, tag, attr):
+        self.collect()
+        ns, name = self.deser.SplitTag(tag)
+        if self.depth == 2:
+            self.info = VmomiSupport.GuessWsdlMethod(name).info
+            self.depth += 1
+            return
+        if self.depth < 2:
+            self.depth += 1
+            return
+
+        # Each parameter goes to the pyVmomi deserializer, list items one at a time
+        if name == '_this':
+            param_type, is_list = vim.ManagedObject, False
+        else:
+            param_type = [p for p in self.info.params if p.name == name][0].type
+            is_list = issubclass(param_type, list)
+            if is_list:
+                param_type = param_type.Item
+        self.pending = (name, is_list)
+        self.deser.Deserialize(self.parser, param_type, False, self.nsMap)
+        self.deser.StartElementHandler(tag, attr)
+
+    def EndElementHandler(self, tag):
+        self.collect()
+        self.depth -= 1
+
+    def CharacterDataHandler(self, data):
+        pass
+
+
+class Fault(Exception):
+
+    def __init__(self, fault):
+        Exception.__init__(self, fault.msg)
+        self.fault = fault
+
+
+class FakeVCenter(object):
+
+    # task_seconds is how long tasks stay running
+    def __init__(self, inventory, task_seconds=0.2):
+        self.inv = inventory
+        self.task_seconds = task_seconds
+        self.results = {}
+        self.tokens = itertools.count(1)
+        self.pending_tasks = []
+        self.collectors = {}
+        self.sessions = itertools.count(1)
+        self.tickets = {}
+
+        # Session of the request being handled, from its cookie
+        self.local = threading.local()
+
+        inv = self.inv
+        self.about = vim.AboutInfo(
+            name='VMware vCenter Server', fullName='Fake vCenter 5.5', vendor='VMware, Inc.',
+            version='5.5.0', build='0', localeVersion='INTL', localeBuild='000', osType='linux-x64',
+            productLineId='vpx', apiType='VirtualCenter', apiVersion='5.5', instanceUuid='fake'
+        )
+        inv.add(vim.ServiceInstance, 'ServiceInstance')
+        inv.add(vmodl.query.PropertyCollector, 'propertyCollector')
+        inv.add(vim.view.ViewManager, 'ViewManager')
+        inv.add(vim.SearchIndex, 'SearchIndex')
+        inv.add(vim.SessionManager, 'SessionManager', currentSession=None)
+        self.collectors['propertyCollector'] = []
+
+    # Runs the effects of tasks that are due
+    def tick(self):
+        with self.inv.lock:
+            now = time.time()
+            due = [t for t in self.pending_tasks if t[0] <= now]
+            self.pending_tasks = [t for t in self.pending_tasks if t[0] > now]
+            for finish_at, task, action in due:
+                info = task.props['info']
+                try:
+                    result = action()
+                    state, error = 'success', None
+                except Fault as e:
+                    result, state, error = None, 'error', e.fault
+                task.props['info'] = vim.TaskInfo(
+                    key=info.key, task=info.task, descriptionId=info.descriptionId,
+                    entity=info.entity, entityName=info.entityName, state=state, progress=100,
+                    result=result, error=error, cancelled=False, cancelable=False,
+                    reason=info.reason, queueTime=info.queueTime, startTime=info.startTime, completeTime=datetime.utcnow()
+                )
+
+    def new_task(self, this, name, action):
+        moid = self.inv.new_moid('task')
+        entity = self.inv.get(this)
+        info = vim.TaskInfo(
+            key=moid, task=vim.Task(moid), descriptionId=name, entity=this,
+            entityName=entity.props.get('name') if entity else None, state='running', progress=0,
+            cancelled=False, cancelable=False, reason=vim.TaskReasonUser(userName='bench'),
+            queueTime=datetime.utcnow(), startTime=datetime.utcnow()
+        )
+        task = self.inv.add(vim.Task, moid, info=info)
+        self.pending_tasks.append((time.time() + self.task_seconds, task, action))
+        return task.ref
+
+    # Session scoped objects carry the session key in their moid, like vCenter's session[...] ids
+    def session_moid(self, kind):
+        return self.inv.new_moid('session[{}]{}'.format(self.current_session(), kind))
+
+    def current_session(self):
+        return getattr(self.local, 'session', None) or 'none'
+
+    def check_session(self, ref):
+        match = re.match(r'session\[([^\]]*)\]', getattr(ref, '_moId', ref) or '')
+        if match and match.group(1) != self.current_session():
+            raise Fault(vmodl.fault.ManagedObjectNotFound(msg='The object belongs to another session', obj=ref))
+
+    def new_session(self, user):
+        now = datetime.utcnow()
+        key = 'fake-{}'.format(next(self.sessions))
+        self.local.new_cookie = key
+        self.local.session = key
+        session = vim.UserSession(
+            key=key, userName=user, fullName=user, loginTime=now,
+            lastActiveTime=now, locale='en', messageLocale='en', extensionSession=False
+        )
+        self.inv.objects['SessionManager'].props['currentSession'] = session
+        return session
+
+    def obj(self, ref):
+        obj = self.inv.get(ref)
+        if not obj:
+            raise Fault(vmodl.fault.ManagedObjectNotFound(msg='The object has already been deleted or has not been completely created', obj=ref))
+        return obj
+
+    # Session
+
+    def RetrieveServiceContent(self, this):
+        return vim.ServiceInstanceContent(
+            rootFolder=vim.Folder('group-d1'),
+            propertyCollector=vmodl.query.PropertyCollector('propertyCollector'),
+            viewManager=vim.view.ViewManager('ViewManager'),
+            searchIndex=vim.SearchIndex('SearchIndex'),
+            sessionManager=vim.SessionManager('SessionManager'),
+            about=self.about
+        )
+
+    def Login(self, this, userName, password, locale=None):
+        return self.new_session(userName)
+
+    def Logout(self, this):
+        self.inv.objects['SessionManager'].props['currentSession'] = None
+
+    def AcquireCloneTicket(self, this):
+        ticket = 'ticket-{}'.format(next(self.tokens))
+        self.tickets[ticket] = self.current_session()
+        return ticket
+
+    def CloneSession(self, this, cloneTicket):
+        if self.tickets.pop(cloneTicket, None) is None:
+            raise Fault(vim.fault.InvalidLogin(msg='Unknown clone ticket'))
+        return self.new_session('clone')
+
+    def CurrentTime(self, this):
+        return datetime.utcnow()
+
+    # Views
+
+    def CreateContainerView(self, this, container, type=None, recursive=False):
+        return self.inv.add(vim.view.ContainerView, self.session_moid('view'), container=container, type=type or [], recursive=recursive).ref
+
+    def CreateListView(self, this, obj=None):
+        return self.inv.add(vim.view.ListView, self.session_moid('list'), view=list(obj or [])).ref
+
+    def ModifyListView(self, this, add=None, remove=None):
+        view = self.obj(this)
+        removed = set(r._moId for r in remove or ())
+        view.props['view'] = [r for r in view.props['view'] if r._moId not in removed] + list(add or ())
+        return []
+
+    def DestroyView(self, this):
+        self.inv.objects.pop(this._moId, None)
+
+    # Property collector
+
+    def traverse(self, moid, skip, select_set, named, out, seen):
+        obj = self.inv.objects.get(moid)
+        if not obj:
+            return
+        if not skip and moid not in seen:
+            seen.add(moid)
+            out.append(obj)
+        for sel in select_set or ():
+            spec = sel if isinstance(sel, vmodl.query.PropertyCollector.TraversalSpec) else named.get(sel.name)
+            if not spec or not issubclass(obj.cls, spec.type):
+                continue
+            if spec.path == 'view' and obj.cls in (vim.view.ContainerView, vim.view.ListView):
+                targets = self.inv.view_contents(obj)
+            else:
+                found, targets = self.inv.get_prop(obj, spec.path)
+                targets = targets if isinstance(targets, list) else [targets] if targets else []
+            for t in targets:
+                self.traverse(t._moId, spec.skip, spec.selectSet, named, out, seen)
+
+    def named_specs(self, select_set, named):
+        for sel in select_set or ():
+            if isinstance(sel, vmodl.query.PropertyCollector.TraversalSpec) and sel.name and sel.name not in named:
+                named[sel.name] = sel
+                self.named_specs(sel.selectSet, named)
+        return named
+
+    # Returns [(obj, {path: val})] for a list of filter specs
+    def collect(self, spec_set):
+        self.tick()
+        results = []
+        with self.inv.lock:
+            for spec in spec_set:
+                objs = []
+                seen = set()
+                for obj_spec in spec.objectSet:
+                    self.check_session(obj_spec.obj)
+                    named = self.named_specs(obj_spec.selectSet, {})
+                    self.traverse(obj_spec.obj._moId, obj_spec.skip, obj_spec.selectSet, named, objs, seen)
+                for obj in objs:
+                    paths = set()
+                    matched = False
+                    for prop_spec in spec.propSet:
+                        if issubclass(obj.cls, prop_spec.type):
+                            matched = True
+                            paths.update(obj.props.keys() if prop_spec.all else prop_spec.pathSet or ())
+                    if not matched:
+                        continue
+                    props = {}
+                    for path in paths:
+                        found, val = self.inv.get_prop(obj, path)
+                        if found and val is not None:
+                            props[path] = val
+                    results.append((obj, props))
+        return results
+
+    def object_content(self, obj, props):
+        return vmodl.query.PropertyCollector.ObjectContent(
+            obj=obj.ref,
+            propSet=[vmodl.DynamicProperty(name=k, val=v) for k, v in sorted(props.iteritems())]
+        )
+
+    # Pages of size objects, the rest waits under a token
+    def page(self, contents, size):
+        token = None
+        if len(contents) > size:
+            token = str(next(self.tokens))
+            self.results[token] = (contents[size:], size, self.current_session())
+        return vmodl.query.PropertyCollector.RetrieveResult(token=token, objects=contents[:size])
+
+    def RetrievePropertiesEx(self, this, specSet, options):
+        contents = [self.object_content(o, p) for o, p in self.collect(specSet)]
+        if not contents:
+            return None
+        return self.page(contents, options.maxObjects or len(contents))
+
+    def ContinueRetrievePropertiesEx(self, this, token):
+        if self.results.get(token, (None, None, None))[2] != self.current_session():
+            raise Fault(vmodl.fault.InvalidArgument(msg='Unknown token', invalidProperty='token'))
+        contents, size, session = self.results.pop(token)
+        return self.page(contents, size)
+
+    def CancelRetrievePropertiesEx(self, this, token):
+        self.results.pop(token, None)
+
+    def RetrieveProperties(self, this, specSet):
+        return [self.object_content(o, p) for o, p in self.collect(specSet)]
+
+    def CreatePropertyCollector(self, this):
+        moid = self.session_moid('collector')
+        self.inv.add(vmodl.query.PropertyCollector, moid)
+        self.collectors[moid] = []
+        return vmodl.query.PropertyCollector(moid)
+
+    def DestroyPropertyCollector(self, this):
+        self.collectors.pop(this._moId, None)
+        self.inv.objects.pop(this._moId, None)
+
+    def CreateFilter(self, this, spec, partialUpdates):
+        moid = self.session_moid('filter')
+        self.inv.add(vmodl.query.PropertyCollector.Filter, moid)
+        self.collectors.setdefault(this._moId, []).append({'moid': moid, 'spec': spec, 'seen': {}})
+        return vmodl.query.PropertyCollector.Filter(moid)
+
+    def DestroyPropertyFilter(self, this):
+        for filters in self.collectors.values():
+            filters[:] = [f for f in filters if f['moid'] != this._moId]
+
+    # Changes since the last call for every filter of the collector
+    def updates(self, collector):
+        filter_sets = []
+        for f in self.collectors.get(collector, ()):
+            current = dict((o.moid, (o, p)) for o, p in self.collect([f['spec']]))
+            object_set = []
+            for moid, (obj, props) in current.iteritems():
+                before = f['seen'].get(moid)
+                changes = [
+                    vmodl.query.PropertyCollector.Change(name=k, op='assign', val=v)
+                    for k, v in sorted(props.iteritems()) if before is None or before.get(k) is not v
+                ]
+                if before is None or changes:
+                    object_set.append(vmodl.query.PropertyCollector.ObjectUpdate(
+                        kind='enter' if before is None else 'modify', obj=obj.ref, changeSet=changes
+                    ))
+            for moid in set(f['seen']) - set(current):
+                object_set.append(vmodl.query.PropertyCollector.ObjectUpdate(kind='leave', obj=vim.ManagedEntity(moid)))
+            f['seen'] = dict((moid, props) for moid, (obj, props) in current.iteritems())
+            if object_set:
+                filter_sets.append(vmodl.query.PropertyCollector.FilterUpdate(
+                    filter=vmodl.query.PropertyCollector.Filter(f['moid']), objectSet=object_set
+                ))
+        return filter_sets
+
+    def WaitForUpdatesEx(self, this, version=None, options=None):
+        max_wait = getattr(options, 'maxWaitSeconds', None)
+        deadline = time.time() + (max_wait if max_wait is not None else 60)
+        while True:
+            filter_sets = self.updates(this._moId)
+            if filter_sets:
+                return vmodl.query.PropertyCollector.UpdateSet(version=str(next(self.tokens)), filterSet=filter_sets)
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.01)
+
+    def CancelWaitForUpdates(self, this):
+        pass
+
+    # Search index
+
+    def FindByInventoryPath(self, this, inventoryPath):
+        obj = self.inv.objects['group-d1']
+        for name in inventoryPath.strip('/').split('/'):
+            children = dict((c.props.get('name'), c) for c in self.inv.children(obj))
+            if obj.cls is vim.Datacenter:
+                children = dict((n, self.inv.objects[obj.props[n + 'Folder']._moId]) for n in ('vm', 'host', 'datastore', 'network'))
+            obj = children.get(name)
+            if not obj:
+                return None
+        return obj.ref
+
+    # Virtual machines
+
+    def CloneVM_Task(self, this, folder, name, spec):
+        source = self.obj(this)
+
+        def clone():
+            props = dict(source.props)
+            vm = self.inv.add(vim.VirtualMachine, self.inv.new_moid('vm'), **props)
+            vm.props['name'] = name
+            vm.props['parent'] = folder
+            vm.props['config.template'] = bool(spec.template)
+            vm.props['snapshot'] = None
+            if spec.location and spec.location.pool:
+                vm.props['resourcePool'] = spec.location.pool
+            if spec.location and spec.location.host:
+                vm.props['runtime.host'] = spec.location.host
+            if spec.location and spec.location.datastore:
+                vm.props['datastore'] = ref_list([spec.location.datastore])
+                self.obj(spec.location.datastore).props['vm'].append(vm.ref)
+            self.reconfigure(vm, spec.config)
+            adapter = spec.customization and spec.customization.nicSettingMap[0].adapter
+            if adapter:
+                vm.props['guest.ipAddress'] = adapter.ip.ipAddress
+                vm.props['guest.hostName'] = '{}.{}'.format(name, adapter.dnsDomain)
+            if spec.powerOn:
+                vm.props['runtime.powerState'] = 'poweredOn'
+                vm.props['guest.guestState'] = 'running'
+            self.obj(folder).props['childEntity'].append(vm.ref)
+            self.obj(vm.props['resourcePool']).props['vm'].append(vm.ref)
+            return vm.ref
+        return self.new_task(this, 'VirtualMachine.clone', clone)
+
+    def reconfigure(self, vm, spec):
+        if not spec:
+            return
+        if spec.numCPUs:
+            vm.props['config.hardware.numCPU'] = spec.numCPUs
+        if spec.memoryMB:
+            vm.props['config.hardware.memoryMB'] = spec.memoryMB
+        if spec.deviceChange:
+            devices = dict((d.key, d) for d in vm.props['config.hardware.device'])
+            for change in spec.deviceChange:
+                devices[change.device.key] = change.device
+            vm.props['config.hardware.device'] = vim.vm.device.VirtualDevice.Array(sorted(devices.values(), key=lambda d: d.key))
+
+    def ReconfigVM_Task(self, this, spec):
+        vm = self.obj(this)
+        return self.new_task(this, 'VirtualMachine.reconfigure', lambda: self.reconfigure(vm, spec))
+
+    def PowerOffVM_Task(self, this):
+        vm = self.obj(this)
+        return self.new_task(this, 'VirtualMachine.powerOff', lambda: vm.props.update({'runtime.powerState': 'poweredOff'}))
+
+    def PowerOnVM_Task(self, this, host=None):
+        vm = self.obj(this)
+        return self.new_task(this, 'VirtualMachine.powerOn', lambda: vm.props.update({'runtime.powerState': 'poweredOn'}))
+
+    def Destroy_Task(self, this):
+        self.obj(this)
+        return self.new_task(this, 'VirtualMachine.destroy', lambda: self.inv.remove(this._moId))
+
+    def CreateSnapshot_Task(self, this, name, description=None, memory=False, quiesce=False):
+        vm = self.obj(this)
+
+        def snapshot():
+            ref = vim.vm.Snapshot(self.inv.new_moid('snapshot'))
+            tree = vim.vm.SnapshotTree(
+                snapshot=ref, vm=this, name=name, description=description or '', id=1,
+                createTime=datetime.utcnow(), state='poweredOff', quiesced=quiesce
+            )
+            vm.props['snapshot'] = vim.vm.SnapshotInfo(currentSnapshot=ref, rootSnapshotList=[tree])
+            return ref
+        return self.new_task(this, 'VirtualMachine.createSnapshot', snapshot)
+
+    def MarkAsTemplate(self, this):
+        self.obj(this).props['config.template'] = True
+
+    def MarkAsVirtualMachine(self, this, pool, host=None):
+        self.obj(this).props['config.template'] = False
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # Clients dropping kept-alive connections are not errors
+    def handle_error(self, request, client_address):
+        pass
+
+
+class SoapHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Whole responses go out in one write, like a real server
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.stats_lock:
+            self.server.stats['connections'] += 1
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, headers=None):
+        headers = dict(headers or {})
+        if 'gzip' in (self.headers.getheader('accept-encoding') or '') and self.server.compression:
+            data = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=data, mode='wb', compresslevel=1) as f:
+                f.write(body)
+            body = data.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        with self.server.stats_lock:
+            self.server.stats['bytes'] += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.iteritems():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.endswith('/vimServiceVersions.xml'):
+            return self.reply(200, VERSIONS_XML)
+        self.reply(404, '')
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        server = self.server
+        with server.stats_lock:
+            server.stats['bytes'] += len(data)
+        if server.latency:
+            time.sleep(server.latency)
+
+        ns_map = SoapAdapter.SOAP_NSMAP.copy()
+        ns_map[NAMESPACE] = ''
+        try:
+            info, this, args = RequestDeserializer().deserialize(data)
+            cookie = re.search(r'vmware_soap_session="([^"]*)"', self.headers.getheader('cookie') or '')
+            server.vcenter.local.session = cookie and cookie.group(1)
+            server.vcenter.local.new_cookie = None
+
+            # Task monitor calls depend on when tasks finish, they are counted apart from other calls
+            with server.stats_lock:
+                server.stats['waits' if info.wsdlName in TASK_MONITOR_METHODS else 'calls'] += 1
+            handler = getattr(server.vcenter, info.wsdlName, None)
+            if not handler:
+                raise Fault(vmodl.fault.NotSupported(msg='{} is not supported by the fake vCenter'.format(info.wsdlName)))
+            server.vcenter.check_session(this)
+            with server.vcenter.inv.lock if info.wsdlName != 'WaitForUpdatesEx' else NoLock():
+                result = handler(this, **args)
+            returnval = ''
+            if result is not None:
+                returnval = SoapAdapter.Serialize(
+                    result,
+                    VmomiSupport.Object(name='returnval', type=info.result, version=VERSION, flags=VmomiSupport.F_OPTIONAL),
+                    VERSION,
+                    ns_map
+                )
+
+        # Bugs in the fake surface as runtime faults with the traceback
+        except Exception as e:
+            if not isinstance(e, Fault):
+                e = Fault(vmodl.RuntimeFault(msg=traceback.format_exc()))
+            # Detail element is named after the fault, like vCenter does
+            detail = SoapAdapter.SerializeFaultDetail(e.fault, version=VERSION, nsMap=ns_map)
+            tag = '{}Fault'.format(e.fault._wsdlName)
+            detail = '<{} xmlns="{}"{}</{}>'.format(tag, NAMESPACE, detail[len('<object'):-len('</object>')], tag)
+            body = '{}<{}><faultcode>ServerFaultCode</faultcode><faultstring>{}</faultstring><detail>{}</detail></{}>{}'.format(
+                SoapAdapter.SOAP_START, SoapAdapter.SOAP_FAULT_TAG, SoapAdapter.XmlEscape(e.fault.msg or ''), detail,
+                SoapAdapter.SOAP_FAULT_TAG, SoapAdapter.SOAP_END
+            )
+            return self.reply(500, body)
+
+        body = '{}<{}Response xmlns="{}">{}</{}Response>{}'.format(
+            SoapAdapter.SOAP_START, info.wsdlName, NAMESPACE, returnval, info.wsdlName, SoapAdapter.SOAP_END
+        )
+        headers = {}
+        if server.vcenter.local.new_cookie:
+            headers['Set-Cookie'] = 'vmware_soap_session="{}"; Path=/; HttpOnly; Secure;'.format(server.vcenter.local.new_cookie)
+        self.reply(200, body, headers)
+
+
+class NoLock(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def self_signed_cert(directory):
+    cert = os.path.join(directory, 'fake-vcenter.pem')
+    if not os.path.exists(cert):
+        subprocess.check_call(
+            ['openssl', 'req', '-x509', '-nodes', '-newkey', 'rsa:2048', '-days', '1', '-subj', '/CN=localhost',
+             '-keyout', cert, '-out', cert],
+            stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT
+        )
+    return cert
+
+
+# Serves vcenter over HTTPS on a free local port, latency is added to every SOAP call
+def serve(vcenter, latency=0.0, cert_dir=None, compression=True):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SoapHandler)
+    server.vcenter = vcenter
+    server.latency = latency
+    server.compression = compression
+    server.stats = {'calls': 0, 'waits': 0, 'bytes': 0, 'connections': 0}
+    server.stats_lock = threading.Lock()
+    cert = self_signed_cert(cert_dir or tempfile.gettempdir())
+    server.socket = ssl.wrap_socket(server.socket, certfile=cert, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, name='fake-vcenter')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+# Standalone server for trying kaslan by hand, e.g. kaslan --host 127.0.0.1 --port <port> status vm00001
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Serve a scripted inventory over the vSphere SOAP API')
+    parser.add_argument('--vms', metavar='N', type=int, help='VMs in the inventory', default=2000)
+    parser.add_argument('--datastores', metavar='N', type=int, help='datastores in the inventory', default=20)
+    parser.add_argument('--portgroups', metavar='N', type=int, help='portgroups in the inventory', default=50)
+    parser.add_argument('--folders', metavar='N', type=int, help='VM folders in the inventory', default=20)
+    parser.add_argument('--latency', metavar='SECONDS', type=float, help='added to every SOAP call', default=0.0)
+    opts = parser.parse_args()
+
+    server = serve(
+        FakeVCenter(build_inventory(vms=opts.vms, datastores=opts.datastores, portgroups=opts.portgroups, folders=opts.folders)),
+        latency=opts.latency
+    )
+    print 'Fake vCenter on 127.0.0.1:{}, Ctrl-C to stop'.format(server.server_address[1])
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print ''
+        print '{calls} calls, {waits} waits, {bytes} bytes, {connections} connections'.format(**server.stats)
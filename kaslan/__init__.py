@@ -1,2 +1,5 @@
 __description__ = 'CLI for common VMware tasks'
 __version__ = '0.6'
+
+# Clone modes, kept here so the CLI can offer them without loading pyVmomi
+CLONE_MODES = ('full', 'linked', 'instant')
@@ -0,0 +1,131 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pyVmomi import vim
+
+
+class AsyncVMware(object):
+
+    def __init__(self, vmware, max_workers=8):
+        self.vmware = vmware
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    # Blocking SOAP calls run on the bounded executor
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    # Runs func on the executor, futures returned by func are followed
+    def follow(self, func, *args, **kwargs):
+        chained = Future()
+
+        def resolve(f):
+            if f.exception() is not None:
+                chained.set_exception(f.exception())
+            elif isinstance(f.result(), Future):
+                f.result().add_done_callback(resolve)
+            else:
+                chained.set_result(f.result())
+
+        self.submit(func, *args, **kwargs).add_done_callback(resolve)
+        return chained
+
+    # Runs func on the result of future
+    def then(self, future, func):
+        chained = Future()
+
+        def copy(f):
+            if f.exception() is not None:
+                chained.set_exception(f.exception())
+            else:
+                chained.set_result(f.result())
+
+        def run(f):
+            if f.exception() is not None:
+                chained.set_exception(f.exception())
+            else:
+                self.follow(func, f.result()).add_done_callback(copy)
+
+        future.add_done_callback(run)
+        return chained
+
+    def gather(self, futures):
+        gathered = Future()
+        futures = list(futures)
+        pending = [len(futures)]
+
+        def done(f):
+            pending[0] -= 1
+            if not pending[0] and not gathered.done():
+                errors = [x.exception() for x in futures if x.exception() is not None]
+                if errors:
+                    gathered.set_exception(errors[0])
+                else:
+                    gathered.set_result([x.result() for x in futures])
+
+        if not futures:
+            gathered.set_result([])
+        for f in futures:
+            f.add_done_callback(done)
+        return gathered
+
+    # Task waits hold no worker, the task monitor resolves them
+    def wait_task(self, task):
+        return self.vmware.tasks.watch(task).future
+
+    def get_obj(self, **kwargs):
+        return self.submit(self.vmware.get_obj, **kwargs)
+
+    def get_props(self, obj, prop_names=None):
+        return self.submit(self.vmware.get_props, obj, prop_names)
+
+    def get_compute(self, vm_name):
+        return self.submit(lambda: tuple(self.vmware.get_compute(vm_name)))
+
+    def set_compute(self, vm_name, memory_mb, cpu_count):
+        def start():
+            vm_obj = self.vmware.get_obj(obj_names=(vm_name,))['obj']
+            spec = vim.vm.ConfigSpec()
+            spec.memoryMB = long(memory_mb)
+            spec.numCPUs = int(cpu_count)
+            return self.wait_task(vm_obj.ReconfigVM_Task(spec=spec))
+        return self.follow(start)
+
+    def destroy(self, vm_name):
+        def power_off():
+            vm = self.vmware.get_obj(obj_names=(vm_name, ), prop_names=('runtime.powerState', ))
+            if vm['runtime.powerState'] == vim.VirtualMachinePowerState.poweredOn:
+                return self.then(self.wait_task(vm['obj'].PowerOff()), lambda _: vm['obj'])
+            return vm['obj']
+
+        def destroy(vm_obj):
+            return self.then(self.wait_task(vm_obj.Destroy()), lambda _: unindex(vm_obj))
+
+        def unindex(vm_obj):
+            if self.vmware.index:
+                self.vmware.index.remove(vim.VirtualMachine._wsdlName, vm_obj._moId)
+            return vm_obj
+
+        return self.then(self.follow(power_off), destroy)
+
+    # Full clone pipeline, resolves with the last task for the new VM
+    def clone(self, template_name, vm_name, vlan, folder_path=None, **kwargs):
+        def start():
+            template_vm, folder, clonespec, networked = self.vmware.prepare_clone(
+                template_name=template_name,
+                vm_name=vm_name,
+                vlan=vlan,
+                folder_path=folder_path,
+                **kwargs
+            )
+            cloned = self.wait_task(self.vmware.start_clone(template_vm, folder, vm_name, clonespec))
+            if networked:
+                return self.then(cloned, lambda task: self.vmware.index_clone(vm_name, task) or task)
+            return self.then(cloned, network)
+
+        def network(task):
+            self.vmware.index_clone(vm_name, task)
+            return self.wait_task(self.vmware.reconfigure_network(vm_name, vlan, task.info.result))
+
+        return self.follow(start)
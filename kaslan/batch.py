@@ -0,0 +1,180 @@
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+import sys
+import threading
+import time
+
+# Limits of the batch line running on this thread
+_current = threading.local()
+
+# Waits without a timeout ignore Ctrl-C on Python 2, so blocking waits poll this often
+POLL_SECONDS = 1.0
+
+
+# Waits for every future, or the first to finish with return_when=FIRST_COMPLETED
+def wait_futures(futures, return_when=ALL_COMPLETED):
+    futures = list(futures)
+    while True:
+        done, pending = wait(futures, timeout=POLL_SECONDS, return_when=return_when)
+        if not pending or (done and return_when == FIRST_COMPLETED):
+            return done, pending
+
+
+def result(future):
+    wait_futures([future])
+    return future.result()
+
+
+# Waits for futures then stops the executor, work not yet started is cancelled if the wait is interrupted
+def shutdown(executor, futures):
+    try:
+        wait_futures(futures)
+    finally:
+        for f in futures:
+            f.cancel()
+        executor.shutdown(wait=False)
+
+
+class PrefixedOutput(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start(self, prefix):
+        self.local.prefix = prefix
+        self.local.buffer = ''
+
+    def finish(self):
+        if self.local.buffer:
+            self.write('\n')
+        self.local.prefix = None
+
+    # Whole lines are written with the prefix of the thread printing them
+    def write(self, text):
+        prefix = getattr(self.local, 'prefix', None)
+        if prefix is None:
+            with self.lock:
+                self.stream.write(text)
+            return
+
+        lines = (self.local.buffer + text).split('\n')
+        self.local.buffer = lines.pop()
+        with self.lock:
+            for line in lines:
+                self.stream.write('{}{}\n'.format(prefix, line))
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+
+class LineResult(object):
+
+    def __init__(self, line_no, line):
+        self.line_no = line_no
+        self.line = line
+        self.code = None
+        self.error = None
+        self.seconds = 0.0
+
+
+# Commands call this once they pick a resource, e.g. a placed datastore, no-op outside a limited batch line
+def hold(kind, name):
+    limits = getattr(_current, 'limits', None)
+    if limits:
+        limits.hold(kind, name)
+
+
+class ResourceLimits(object):
+
+    def __init__(self, ds_limit=None, cluster_limit=None):
+        self.limits = {'datastore': ds_limit, 'cluster': cluster_limit}
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    # Datastores chosen from a prefix are held by the command once placed
+    def keys(self, args):
+        keys = []
+        ds = getattr(args, 'ds_name', None)
+        if ds:
+            keys.append(('datastore', ds))
+        cluster = getattr(args, 'cluster_name', None)
+        if cluster:
+            keys.append(('cluster', cluster))
+
+        # Sorted so every worker acquires in the same order
+        return sorted(k for k in keys if self.limits[k[0]])
+
+    def semaphore(self, key):
+        with self.lock:
+            if key not in self.semaphores:
+                self.semaphores[key] = threading.Semaphore(self.limits[key[0]])
+            return self.semaphores[key]
+
+    # Clusters sort before datastores and placed datastores come last, so every worker acquires in the same order
+    def hold(self, kind, name):
+        if not self.limits.get(kind):
+            return
+        semaphore = self.semaphore((kind, name))
+        semaphore.acquire()
+        self.local.held.append(semaphore)
+
+    def run(self, args, func):
+        self.local.held = []
+        _current.limits = self
+        try:
+            for kind, name in self.keys(args):
+                self.hold(kind, name)
+            return func()
+        finally:
+            _current.limits = None
+            for s in reversed(self.local.held):
+                s.release()
+
+
+def run_line(parser, config, output, limits, result):
+    output.start('[line {}] '.format(result.line_no))
+    start = time.time()
+    try:
+        args = parser.parse_args(result.line.split())
+        limits.run(args, lambda: args.func(args, config))
+        result.code = 0
+    except SystemExit as e:
+        result.code = e.code or 0
+    except Exception as e:
+        result.error = str(e)
+        result.code = 1
+        print 'Error: {}'.format(e)
+    finally:
+        result.seconds = time.time() - start
+        output.finish()
+    return result
+
+
+def run_parallel(parser, lines, config, workers, ds_limit=None, cluster_limit=None):
+    results = [LineResult(n, l.strip()) for n, l in enumerate(lines, 1) if l.strip()]
+    limits = ResourceLimits(ds_limit, cluster_limit)
+
+    # Route prints from worker threads through a prefixing writer
+    stdout = sys.stdout
+    output = PrefixedOutput(stdout)
+    sys.stdout = output
+    try:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(run_line, parser, config, output, limits, r) for r in results]
+        shutdown(executor, futures)
+        for f in futures:
+            f.result()
+    finally:
+        sys.stdout = stdout
+
+    # Summarize
+    failed = [r for r in results if r.code]
+    print ''
+    print 'Batch: {} succeeded, {} failed'.format(len(results) - len(failed), len(failed))
+    for r in failed:
+        print '[line {}] exit {} ({:.1f}s): {}'.format(r.line_no, r.code, r.seconds, r.error or r.line)
+
+    return results
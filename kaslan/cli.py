@@ -1,17 +1,29 @@
+import time
+
+# Import time counts from here
+_start = time.time()
+
 from kaslan import __description__
+from kaslan import commands, daemon, timing, wire
 from kaslan.exceptions import CLIException
-from kaslan.commands import clone, datastore, compute, disks, status, destroy
+from kaslan.commands import clone, clone_batch, datastore, compute, disks, status, destroy, export, sync, serve
 from argparse import ArgumentParser
 from os.path import expanduser
 import getpass
 import yaml
 import fileinput
+import sys
+
+
+# Loaded kaslan.yaml, tables compiled from it are kept as attributes so they live as long as the config
+class Config(dict):
+    pass
 
 
 def get_config(path_list):
     for f in path_list:
         try:
-            return yaml.load(file(f))
+            return Config(yaml.load(file(f)) or {})
         except IOError:
             continue
 
@@ -20,36 +32,114 @@ def get_config(path_list):
     raise CLIException('Could not find a valid configuration file.')
 
 
-def main():
-
-    # Load configuration
-    config = get_config((
-        './kaslan.yaml',
-        expanduser('~/.kaslan.yaml'),
-        '/etc/kaslan.yaml',
-    ))
+def get_parser(config):
 
     # Create main parser
     parser = ArgumentParser(description=__description__)
     parser.add_argument('-u', dest='vcenter_user', help='Override vCenter user', default=getpass.getuser())
     parser.add_argument('--host', dest='vcenter_host', help='Override vCenter host', default=config['vcenter_host'])
     parser.add_argument('--port', dest='vcenter_port', help='Override vCenter port', default=config['vcenter_port'])
+    parser.add_argument('--timing', help='print import, config, connect, command and clone stage times', action='store_true', default=False)
+    parser.add_argument('--profile', help='print a summary of the SOAP calls made', action='store_true', default=False)
+    parser.add_argument('--profile-trace', dest='profile_trace', metavar='PATH', help='write every SOAP call as a JSON line to PATH (implies --profile)')
+    parser.add_argument('--no-daemon', dest='no_daemon', help='Run locally even if a kaslan daemon is running', action='store_true', default=False)
     subparsers = parser.add_subparsers(dest='cmd')
 
     # Stdin oarser
     parser_stdin = subparsers.add_parser('input', help='Process commands from input')
     parser_stdin.add_argument('filenames', help='files to use instead of stdin', nargs='*')
+    parser_stdin.add_argument('--parallel', metavar='N', type=int, help='run up to N commands at once on a shared session', default=1)
+    parser_stdin.add_argument('--ds-limit', dest='ds_limit', metavar='N', type=int, help='concurrent commands per datastore, the placed one with --ds_prefix (with --parallel)', default=config.get('batch', {}).get('ds_limit'))
+    parser_stdin.add_argument('--cluster-limit', dest='cluster_limit', metavar='N', type=int, help='concurrent commands per cluster (with --parallel)', default=config.get('batch', {}).get('cluster_limit'))
 
     # Command parsers
-    for cmd in (datastore, clone, compute, disks, status, destroy):
+    for cmd in (datastore, clone, clone_batch, compute, disks, status, destroy, export, sync, serve):
         cmd.cli_setup(subparsers, config)
 
+    return parser
+
+
+def main():
+    timing.record('import', time.time() - _start)
+
+    # Load configuration
+    with timing.timed('config'):
+        config = get_config((
+            './kaslan.yaml',
+            expanduser('~/.kaslan.yaml'),
+            '/etc/kaslan.yaml',
+        ))
+
     # Parse arguments
+    parser = get_parser(config)
     args = parser.parse_args()
-    if args.cmd == 'input':
+    if args.profile_trace:
+        args.profile = True
+    if args.profile:
+        wire.start_profile()
+
+    try:
+        with timing.timed('command'):
+            run(parser, args, config)
+    finally:
+        if args.timing:
+            timing.report(time.time() - _start)
+        if args.profile:
+            report_profile(args)
+        if args.timing or args.profile:
+            report_views(args)
+
+
+# Container view reuse, once a command has connected in this process, printed once for --timing and --profile
+def report_views(args):
+    vmware = commands._vmware
+    if not vmware:
+        return
+    out = sys.stderr if getattr(args, 'raw_output', False) else sys.stdout
+    print >>out, ''
+    print >>out, 'Views: {created} created, {reused} reused, {destroyed} destroyed, {active} active'.format(**vmware.views.stats())
+
+
+def report_profile(args):
+    profile = wire.get_profile()
+
+    # Streamed output stays clean on stdout
+    out = sys.stderr if getattr(args, 'raw_output', False) else sys.stdout
+    profile.report(out=out)
+    if args.profile_trace:
+        try:
+            profile.write_trace(args.profile_trace)
+        except IOError as e:
+            raise CLIException('Could not write {}: {}'.format(args.profile_trace, e.strerror))
+        print >>out, 'Trace of {} calls written to {}'.format(len(profile.calls), args.profile_trace)
+
+
+def run(parser, args, config):
+
+    # Hand off to a running daemon, profiling needs the calls made here
+    if not args.no_daemon and not getattr(args, 'profile', False) and args.cmd in daemon.COMMANDS:
+        code = daemon.forward(config.get('socket_path', serve.DEFAULT_SOCKET), sys.argv[1:])
+        if code is not None:
+            print ''
+            sys.exit(code)
+
+    if args.cmd == 'input' and args.parallel > 1:
+        from kaslan.batch import run_parallel
+        results = run_parallel(
+            parser,
+            list(fileinput.input(args.filenames)),
+            config,
+            args.parallel,
+            ds_limit=args.ds_limit,
+            cluster_limit=args.cluster_limit
+        )
+        if any(r.code for r in results):
+            sys.exit(1)
+    elif args.cmd == 'input':
         for line in fileinput.input(args.filenames):
             args = parser.parse_args(line.split())
             args.func(args, config)
     else:
         args.func(args, config)
-    print ''
+    if not getattr(args, 'raw_output', False):
+        print ''
@@ -1,18 +1,99 @@
-from kaslan.vmware import VMware
+from kaslan import timing
+from kaslan.exceptions import CLIException
 import getpass
+import threading
 
 # Global variable of VMware object
 _vmware = None
+_vmware_lock = threading.Lock()
 
+# Cleared by the daemon, which has no terminal to prompt on
+_prompt = True
 
-def get_vmware(args, config):
+
+# password is only needed to log in, see get_password
+def get_vmware(args, config, password=None):
+    global _vmware
+    with _vmware_lock:
+        if not _vmware:
+            _vmware = new_vmware(args, config, password)
+
+    # Commands streaming data keep stdout clean
+    if not getattr(args, 'raw_output', False):
+        print ''
+    return _vmware
+
+
+# Drops the shared connection so the next command logs in again
+def reset_vmware():
     global _vmware
-    if not _vmware:
-        _vmware = VMware(
+    with _vmware_lock:
+        vmware, _vmware = _vmware, None
+    if vmware:
+        try:
+            vmware.disconnect()
+        except Exception:
+            pass
+
+
+def disable_prompt():
+    global _prompt
+    _prompt = False
+
+
+def prompt_password(args):
+    if not _prompt:
+        raise CLIException('vCenter session for {}@{} was lost and kaslan serve cannot prompt for a password, restart it'.format(
+            args.vcenter_user, args.vcenter_host
+        ))
+    return getpass.getpass('{}@{}: '.format(args.vcenter_user, args.vcenter_host))
+
+
+# Asks for the password on the calling thread, so the login itself can run on a worker
+# None when already connected or a saved session will be tried first
+def get_password(args, config):
+    from kaslan.session import SessionCache
+
+    if _vmware:
+        return None
+    if config.get('session_cache', False):
+        if SessionCache(args.vcenter_host, args.vcenter_port, args.vcenter_user, config.get('cache_dir', '~/.cache/kaslan')).load():
+            return None
+    return prompt_password(args)
+
+
+def new_vmware(args, config, password=None):
+
+    # pyVmomi is only loaded once a command needs vCenter
+    with timing.timed('libraries'):
+        from kaslan.inventory import InventoryIndex
+        from kaslan.session import SessionCache
+        from kaslan.vmware import VMware
+
+    # Persistent name to MoRef index
+    index = None
+    if config.get('inventory_cache', True):
+        index = InventoryIndex(args.vcenter_host, config.get('cache_dir', '~/.cache/kaslan'))
+
+    # Opt-in saved session
+    session_cache = None
+    if config.get('session_cache', False):
+        session_cache = SessionCache(args.vcenter_host, args.vcenter_port, args.vcenter_user, config.get('cache_dir', '~/.cache/kaslan'))
+
+    with timing.timed('connect'):
+        return VMware(
             host=args.vcenter_host,
             port=args.vcenter_port,
             user=args.vcenter_user,
-            password=getpass.getpass('{}@{}: '.format(args.vcenter_user, args.vcenter_host))
+            password=password if password is not None else lambda: prompt_password(args),
+            max_views=config.get('max_views', 16),
+            page_size=config.get('page_size', 500),
+            index=index,
+            session_cache=session_cache,
+            placement_ttl=config.get('placement_ttl', 300),
+            portgroup_ttl=config.get('portgroup_ttl', 3600),
+            sessions=config.get('sessions', 1),
+            connections=config.get('connections', 8),
+            compression=config.get('compression', True),
+            idle_timeout=config.get('connection_idle_timeout', 900)
         )
-    print ''
-    return _vmware
@@ -1,6 +1,7 @@
-from kaslan.commands import get_vmware
+from kaslan import CLONE_MODES, timing
+from kaslan.commands import get_password, get_vmware
 from kaslan.exceptions import CLIException
-from netaddr import IPNetwork, IPAddress
+from kaslan.placement import STRATEGIES
 import socket
 import os
 
@@ -21,8 +22,9 @@ def cli_setup(subparsers, config):
     parser_opts.add_argument('--cluster', dest='cluster_name', help='cluster', default=config['defaults']['cluster'])
     parser_opts.add_argument('--ds', dest='ds_name', help='datastore name (required if --ds_prefix not provided)')
     parser_opts.add_argument('--ds_prefix', dest='ds_prefix', help='datastore prefix (required if --ds not provided)')
-    parser_opts.add_argument('--ds_prov_limit', dest='ds_prov_limit', help='datastore provision percentage limit (used with --ds_prefix)', default=config['defaults']['ds_prov_limit'])
-    parser_opts.add_argument('--ds_vm_limit', dest='ds_vm_limit', help='datastore VM limit (used with --ds_prefix)', default=config['defaults']['ds_vm_limit'])
+    parser_opts.add_argument('--ds_prov_limit', dest='ds_prov_limit', help='datastore provision percentage limit (used with --ds_prefix)', type=float, default=config['defaults']['ds_prov_limit'])
+    parser_opts.add_argument('--ds_vm_limit', dest='ds_vm_limit', help='datastore VM limit (used with --ds_prefix)', type=int, default=config['defaults']['ds_vm_limit'])
+    parser_opts.add_argument('--ds_strategy', dest='ds_strategy', help='datastore placement strategy (used with --ds_prefix)', choices=sorted(STRATEGIES), default=config['defaults'].get('ds_strategy', 'most_free'))
     parser_opts.add_argument('--folder', dest='folder_path', help='folder path, with / delimiter', default=config['defaults'].get('folder'))
     parser_opts.add_argument('--ip', help='IP address for VM, defaults to DNS lookup of vm_name', default=None)
     parser_opts.add_argument('--cpus', '-c', metavar='COUNT', help='CPU count for VM', type=int, default=config['defaults']['cpus'])
@@ -30,9 +32,25 @@ def cli_setup(subparsers, config):
     parser_opts.add_argument('--domain', '-d', help='domain', default=config['defaults']['domain'])
     parser_opts.add_argument('--no-template-alias', help='allow the use of a template whose alias is not configured', action='store_true', default=False)
     parser_opts.add_argument('--force', help='ignore pre-checks like ping test', action='store_true', default=False)
+    parser_modes = parser_opts.add_mutually_exclusive_group()
+    parser_modes.add_argument('--linked', dest='clone_mode', help='linked clone from the template base snapshot', action='store_const', const='linked')
+    parser_modes.add_argument('--instant', dest='clone_mode', help='instant clone of a running source VM (vSphere 6.7+)', action='store_const', const='instant')
+    parser_modes.add_argument('--clone-mode', dest='clone_mode', help='clone mode', choices=CLONE_MODES)
+    parser.set_defaults(clone_mode=config['defaults'].get('clone_mode', 'full'))
+
+
+def resolve_ip(vm_name, domain):
+    return repr(socket.gethostbyname('{}.{}'.format(vm_name, domain)))[1:-1]
+
+
+def responds_to_ping(ip):
+    return os.system('ping -c1 -W1 {} > /dev/null 2>&1'.format(ip)) == 0
 
 
 def func(args, config):
+    from concurrent.futures import ThreadPoolExecutor
+    from kaslan.batch import hold, result
+    from kaslan.networks import get_net_settings
 
     # Normalize some arguments
     args.vm_name = args.vm_name.lower()
@@ -42,54 +60,89 @@ def func(args, config):
     if not any((args.ds_name, args.ds_prefix)):
         raise CLIException('Require to specify datastore using either --ds or --ds_prefix')
 
-    # Get IP address from name if not provided
-    if not args.ip:
-        args.ip = repr(socket.gethostbyname('{}.{}'.format(args.vm_name, args.domain)))[1:-1]
-
-    # Make sure IP address isn't used
-    if not args.force and os.system('ping -c1 -W1 {} > /dev/null 2>&1'.format(args.ip)) == 0:
-        raise CLIException('IP address {} is responding to ping, use --force to ignore ping response'.format(args.ip))
-
-    # Get network settings
-    net_settings = None
-    for n, s in config['networks'].iteritems():
-        if IPAddress(args.ip) not in IPNetwork(n):
-            continue
-
-        net_settings = s
-        net_settings['subnet'] = str(IPNetwork(n).netmask)
-        break
-
-    # Check if settings set
-    if not net_settings:
-        raise CLIException('Network for {} not configured in kaslan.yaml'.format(args.ip))
-
-    # Check if all settings are given
-    if not all(k in net_settings for k in ('subnet', 'gateway', 'dns')):
-        raise CLIException('Network for {} missing settings in kaslan.yaml'.format(args.ip))
-
     # Get template name from alias
     if not args.no_template_alias:
         try:
             template_name = config['templates'][args.template]
         except KeyError:
-            CLIException('Template {} is not configured in kaslan.yaml, use --no-template-alias to force'.format(args.template))
+            raise CLIException('Template {} is not configured in kaslan.yaml, use --no-template-alias to force'.format(args.template))
     else:
         template_name = args.template
 
-    # Get VMware
-    vmware = get_vmware(args, config)
-    if not args.ds_name:
-        args.ds_name = vmware.choose_a_datastore(
-            args.cluster_name,
-            args.ds_prefix,
-            args.ds_prov_limit,
-            args.ds_vm_limit
-        )
-        print 'Using datastore {}...'.format(args.ds_name)
-
-    # Perform the clone
-    vmware.clone(
-        template_name=template_name,
-        **dict(vars(args).items() + net_settings.items())
-    )
+    # Password is asked for up front, so a failed precheck never leaves a prompt behind
+    password = get_password(args, config)
+    executor = ThreadPoolExecutor(max_workers=3)
+    try:
+
+        # Session connects while prechecks run
+        connecting = executor.submit(get_vmware, args, config, password)
+
+        # Get IP address from name if not provided
+        if not args.ip:
+            args.ip = timing.call('dns', resolve_ip, args.vm_name, args.domain)
+
+        # Make sure IP address isn't used, ping runs while we match the network
+        pinging = None
+        if not args.force:
+            pinging = executor.submit(timing.call, 'ping', responds_to_ping, args.ip)
+        net_settings = timing.call('network', get_net_settings, args.ip, config)
+        if pinging and result(pinging):
+            raise CLIException('IP address {} is responding to ping, use --force to ignore ping response'.format(args.ip))
+
+        # Placement reads datastores while the template is resolved
+        vmware = result(connecting)
+        placed = not args.ds_name
+        size = 0
+        if placed:
+
+            # Linked and instant clones only write child disks
+            sizing = None
+            if args.clone_mode == 'full':
+                sizing = executor.submit(timing.call, 'template', vmware.get_template_size, template_name)
+            timing.call(
+                'datastores',
+                vmware.get_placement,
+                args.cluster_name,
+                args.ds_prefix,
+                args.ds_prov_limit,
+                args.ds_vm_limit,
+                strategy=args.ds_strategy
+            )
+            size = result(sizing) if sizing else 0
+            args.ds_name = timing.call(
+                'placement',
+                vmware.choose_a_datastore,
+                args.cluster_name,
+                args.ds_prefix,
+                args.ds_prov_limit,
+                args.ds_vm_limit,
+                strategy=args.ds_strategy,
+                size=size
+            )
+            print 'Using datastore {}...'.format(args.ds_name)
+
+            # Batch limits count the placed datastore, not the prefix
+            hold('datastore', args.ds_name)
+
+    finally:
+        executor.shutdown(wait=False)
+
+    # Perform the clone, a failed one frees its datastore booking for later clones in this process
+    cloned = False
+    try:
+        with timing.timed('clone'):
+            cloned = vmware.clone(
+                template_name=template_name,
+                **dict(vars(args).items() + net_settings.items())
+            )
+    finally:
+        if placed and not cloned:
+            vmware.release_datastore(
+                args.ds_name,
+                args.cluster_name,
+                args.ds_prefix,
+                args.ds_prov_limit,
+                args.ds_vm_limit,
+                strategy=args.ds_strategy,
+                size=size
+            )
@@ -0,0 +1,302 @@
+from kaslan import CLONE_MODES
+from kaslan.commands import get_password, get_vmware
+from kaslan.commands.clone import resolve_ip, responds_to_ping
+from kaslan.exceptions import CLIException
+from kaslan.placement import STRATEGIES
+import csv
+import sys
+import time
+import yaml
+
+# Manifest columns and the clone arguments they set
+FIELDS = {
+    'template': 'template',
+    'vm_name': 'vm_name',
+    'ip': 'ip',
+    'cpus': 'cpus',
+    'memory': 'memory',
+    'datacenter': 'datacenter_name',
+    'cluster': 'cluster_name',
+    'ds': 'ds_name',
+    'ds_prefix': 'ds_prefix',
+    'folder': 'folder_path',
+    'domain': 'domain',
+    'clone_mode': 'clone_mode',
+}
+
+
+def cli_setup(subparsers, config):
+    # Clone batch parser
+    parser = subparsers.add_parser('clone-batch', help='Clone VMs listed in a YAML or CSV manifest')
+    parser.set_defaults(func=func)
+
+    # Clone batch: arguments
+    parser_args = parser.add_argument_group('batch arguments')
+    parser_args.add_argument('manifest', help='YAML list or CSV file of VMs, columns: {}'.format(', '.join(sorted(FIELDS))))
+
+    # Clone batch: defaults for entries that do not set them
+    parser_opts = parser.add_argument_group('batch defaults')
+    parser_opts.add_argument('--datacenter', dest='datacenter_name', help='datacenter', default=config['defaults']['datacenter'])
+    parser_opts.add_argument('--cluster', dest='cluster_name', help='cluster', default=config['defaults']['cluster'])
+    parser_opts.add_argument('--ds', dest='ds_name', help='datastore name')
+    parser_opts.add_argument('--ds_prefix', dest='ds_prefix', help='datastore prefix')
+    parser_opts.add_argument('--ds_prov_limit', dest='ds_prov_limit', help='datastore provision percentage limit (used with --ds_prefix)', type=float, default=config['defaults']['ds_prov_limit'])
+    parser_opts.add_argument('--ds_vm_limit', dest='ds_vm_limit', help='datastore VM limit (used with --ds_prefix)', type=int, default=config['defaults']['ds_vm_limit'])
+    parser_opts.add_argument('--ds_strategy', dest='ds_strategy', help='datastore placement strategy (used with --ds_prefix)', choices=sorted(STRATEGIES), default=config['defaults'].get('ds_strategy', 'spread'))
+    parser_opts.add_argument('--folder', dest='folder_path', help='folder path, with / delimiter', default=config['defaults'].get('folder'))
+    parser_opts.add_argument('--cpus', '-c', metavar='COUNT', help='CPU count for VM', type=int, default=config['defaults']['cpus'])
+    parser_opts.add_argument('--memory', '-m', metavar='GB', help='memory for VM', type=long, default=config['defaults']['memory_gb'])
+    parser_opts.add_argument('--domain', '-d', help='domain', default=config['defaults']['domain'])
+    parser_opts.add_argument('--clone-mode', dest='clone_mode', help='clone mode', choices=CLONE_MODES, default=config['defaults'].get('clone_mode', 'full'))
+    parser_opts.add_argument('--workers', metavar='N', type=int, help='clones in flight at once', default=config.get('batch', {}).get('clone_workers', 4))
+    parser_opts.add_argument('--no-template-alias', help='allow the use of templates whose alias is not configured', action='store_true', default=False)
+    parser_opts.add_argument('--force', help='ignore pre-checks like ping test', action='store_true', default=False)
+
+
+class CloneEntry(object):
+
+    def __init__(self, line_no, params):
+        self.line_no = line_no
+        self.params = params
+        self.template_name = None
+        self.net_settings = None
+        self.error = None
+        self.started = None
+        self.seconds = 0.0
+
+        # Bytes booked on a datastore placed for this entry, None when the manifest named one
+        self.placed_size = None
+
+    @property
+    def vm_name(self):
+        return self.params.get('vm_name') or '?'
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            if path.lower().endswith('.csv'):
+                rows = [r for r in csv.DictReader(f)]
+            else:
+                rows = yaml.safe_load(f) or []
+    except IOError as e:
+        raise CLIException('Could not read manifest {}: {}'.format(path, e.strerror))
+
+    # YAML may nest the list under a key
+    if isinstance(rows, dict):
+        rows = rows.get('vms', [])
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise CLIException('Manifest {} must be a list of VM entries'.format(path))
+    return rows
+
+
+def build_entries(rows, args):
+    entries = []
+    for line_no, row in enumerate(rows, 1):
+        params = {}
+        for field, dest in FIELDS.iteritems():
+            params[dest] = getattr(args, dest, None)
+        for field, value in row.iteritems():
+            if field not in FIELDS:
+                raise CLIException('Manifest entry {} has unknown column {}'.format(line_no, field))
+            if value not in (None, ''):
+                params[FIELDS[field]] = value
+        for key in ('ds_prov_limit', 'ds_vm_limit', 'ds_strategy'):
+            params[key] = getattr(args, key)
+        entries.append(CloneEntry(line_no, params))
+    return entries
+
+
+# Checks that need no vCenter
+def validate(entry, args, config):
+    from kaslan.networks import get_net_settings
+    params = entry.params
+    try:
+        for key in ('template', 'vm_name'):
+            if not params.get(key):
+                raise CLIException('missing {}'.format(key))
+        params['vm_name'] = str(params['vm_name']).lower()
+        params['domain'] = str(params['domain']).lower()
+        params['cpus'] = int(params['cpus'])
+        params['memory'] = long(params['memory'])
+        if params['clone_mode'] not in CLONE_MODES:
+            raise CLIException('unknown clone mode {}'.format(params['clone_mode']))
+        if not any((params.get('ds_name'), params.get('ds_prefix'))):
+            raise CLIException('no datastore, set ds or ds_prefix')
+
+        # Template alias
+        if args.no_template_alias:
+            entry.template_name = params['template']
+        elif params['template'] in config['templates']:
+            entry.template_name = config['templates'][params['template']]
+        else:
+            raise CLIException('template {} is not configured in kaslan.yaml'.format(params['template']))
+
+        # Network
+        if not params.get('ip'):
+            params['ip'] = resolve_ip(params['vm_name'], params['domain'])
+        entry.net_settings = get_net_settings(params['ip'], config)
+        if not args.force and responds_to_ping(params['ip']):
+            raise CLIException('IP address {} is responding to ping'.format(params['ip']))
+
+    except Exception as e:
+        entry.error = str(e)
+    return entry
+
+
+def report_errors(entries):
+    failed = [e for e in entries if e.error]
+    if failed:
+        for e in failed:
+            print '[entry {}] {}: {}'.format(e.line_no, e.vm_name, e.error)
+        raise CLIException('{} of {} manifest entries failed validation, nothing was cloned'.format(len(failed), len(entries)))
+
+
+def func(args, config):
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+    from kaslan.aio import AsyncVMware
+    from kaslan.batch import PrefixedOutput, result, shutdown, wait_futures
+    from kaslan.vmware import CLONE_LOOKUPS
+    from pyVmomi import vim
+
+    entries = build_entries(load_manifest(args.manifest), args)
+    if not entries:
+        raise CLIException('Manifest {} has no entries'.format(args.manifest))
+
+    # Local checks for every entry before anything is cloned, the session connects meanwhile
+    password = get_password(args, config)
+    executor = ThreadPoolExecutor(max_workers=max(args.workers, 1) * 4)
+    connecting = executor.submit(get_vmware, args, config, password)
+    checks = [executor.submit(validate, e, args, config) for e in entries]
+    shutdown(executor, checks)
+    for f in checks:
+        f.result()
+    names = {}
+    for e in entries:
+        if not e.error and e.params['vm_name'] in names:
+            e.error = 'duplicate of entry {}'.format(names[e.params['vm_name']])
+        names.setdefault(e.params['vm_name'], e.line_no)
+    report_errors(entries)
+
+    # Shared objects resolved once with what every clone reads from them, and handed to the clones
+    vmware = result(connecting)
+    props = dict(CLONE_LOOKUPS)
+    props[vim.VirtualMachine] += ('summary.storage', )
+    resolved = {}
+
+    def resolve(lookups):
+        lookups = [l for l in set(lookups) if l not in resolved]
+        try:
+            resolved.update(zip(lookups, vmware.get_objs([(t, n, props[t]) for t, n in lookups])))
+        except Exception as e:
+            raise CLIException('Manifest objects not found: {}'.format(e))
+
+    lookups = []
+    for e in entries:
+        lookups.append((vim.VirtualMachine, e.template_name))
+        lookups.append((vim.Datacenter, e.params['datacenter_name']))
+        lookups.append((vim.ClusterComputeResource, e.params['cluster_name']))
+        if e.params.get('ds_name'):
+            lookups.append((vim.Datastore, e.params['ds_name']))
+    resolve(lookups)
+    folders = {}
+    for folder in set((e.params['folder_path'], e.params['datacenter_name']) for e in entries if e.params['folder_path']):
+        folders[folder] = vmware.get_folder(*folder)
+    vmware.ensure_portgroups()
+
+    # Placed datastores are given back when their clone won't happen
+    def release(e):
+        if e.placed_size is not None:
+            vmware.release_datastore(
+                e.params['ds_name'],
+                e.params['cluster_name'],
+                e.params['ds_prefix'],
+                e.params['ds_prov_limit'],
+                e.params['ds_vm_limit'],
+                strategy=e.params['ds_strategy'],
+                size=e.placed_size
+            )
+            e.placed_size = None
+
+    # Datastores placed against the limits up front
+    for e in entries:
+        if e.params.get('ds_name'):
+            continue
+        size = 0
+        if e.params['clone_mode'] == 'full':
+            storage = resolved[(vim.VirtualMachine, e.template_name)]['summary.storage']
+            size = (storage.committed or 0) + (storage.uncommitted or 0)
+        try:
+            e.params['ds_name'] = vmware.choose_a_datastore(
+                e.params['cluster_name'],
+                e.params['ds_prefix'],
+                e.params['ds_prov_limit'],
+                e.params['ds_vm_limit'],
+                strategy=e.params['ds_strategy'],
+                size=size
+            )
+            e.placed_size = size
+        except Exception as error:
+            e.error = str(error)
+    if any(e.error for e in entries):
+        for e in entries:
+            release(e)
+    report_errors(entries)
+    resolve([(vim.Datastore, e.params['ds_name']) for e in entries])
+
+    # Bounded number of clones in flight, one task watcher for all of them
+    print 'Cloning {} VMs, {} at a time...'.format(len(entries), args.workers)
+    aio = AsyncVMware(vmware, max_workers=args.workers)
+    start = time.time()
+    futures = []
+
+    # Lines printed from clone threads are written whole
+    stdout = sys.stdout
+    output = PrefixedOutput(stdout)
+    sys.stdout = output
+    try:
+        for e in entries:
+            while sum(1 for f in futures if not f.done()) >= max(args.workers, 1):
+                wait_futures([f for f in futures if not f.done()], return_when=FIRST_COMPLETED)
+            e.started = time.time()
+            params = dict(e.params.items() + e.net_settings.items())
+            params.pop('template')
+            future = aio.clone(
+                template_name=e.template_name,
+                resolved=resolved,
+                folder=folders.get((params['folder_path'], params['datacenter_name'])),
+                **params
+            )
+
+            def done(f, e=e):
+                e.seconds = time.time() - e.started
+                if f.exception() is not None:
+                    e.error = getattr(f.exception(), 'msg', None) or str(f.exception())
+                    release(e)
+                output.start('[entry {}] '.format(e.line_no))
+                print '{} {} in {:.1f}s'.format(e.vm_name, 'failed' if e.error else 'cloned', e.seconds)
+                output.finish()
+
+            future.add_done_callback(done)
+            futures.append(future)
+        wait_futures(futures)
+    finally:
+        sys.stdout = stdout
+    aio.shutdown()
+    total = time.time() - start
+
+    # Summarize
+    failed = [e for e in entries if e.error]
+    print ''
+    print '{:<6} {:<30} {:<20} {:<8} {:>8}'.format('Entry', 'VM', 'Datastore', 'Result', 'Time')
+    for e in entries:
+        print '{:<6} {:<30} {:<20} {:<8} {:>7.1f}s'.format(e.line_no, e.vm_name, e.params['ds_name'], 'failed' if e.error else 'ok', e.seconds)
+    for e in failed:
+        print '[entry {}] {}: {}'.format(e.line_no, e.vm_name, e.error)
+    print ''
+    print 'Cloned      : {} of {}'.format(len(entries) - len(failed), len(entries))
+    print 'Time        : {:.1f}s'.format(total)
+    print 'Throughput  : {:.2f} VMs/min'.format((len(entries) - len(failed)) / total * 60 if total else 0)
+
+    if failed:
+        raise CLIException('{} of {} clones failed'.format(len(failed), len(entries)))
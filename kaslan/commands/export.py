@@ -0,0 +1,128 @@
+from kaslan.commands import get_vmware
+from kaslan.exceptions import CLIException
+from collections import OrderedDict
+import csv
+import datetime
+import json
+import sys
+
+# Default properties per exported type
+KINDS = {
+    'vms': ('VirtualMachine', (
+        'runtime.powerState',
+        'config.hardware.numCPU',
+        'config.hardware.memoryMB',
+        'guest.ipAddress',
+        'guest.hostName',
+        'config.guestFullName',
+        'runtime.host',
+    )),
+    'datastores': ('Datastore', (
+        'summary.type',
+        'summary.capacity',
+        'summary.freeSpace',
+        'summary.uncommitted',
+        'summary.accessible',
+    )),
+    'hosts': ('HostSystem', (
+        'runtime.connectionState',
+        'runtime.inMaintenanceMode',
+        'summary.hardware.numCpuCores',
+        'summary.hardware.memorySize',
+        'parent',
+    )),
+}
+
+
+def cli_setup(subparsers, config):
+
+    # Export parser
+    parser = subparsers.add_parser('export', help='Stream inventory as NDJSON or CSV')
+    parser.set_defaults(func=func, raw_output=True)
+
+    # Export: arguments
+    parser_args = parser.add_argument_group('export arguments')
+    parser_args.add_argument('kind', help='objects to export', choices=sorted(KINDS))
+
+    # Export: options
+    parser_opts = parser.add_argument_group('export options')
+    parser_opts.add_argument('--format', dest='export_format', help='output format', choices=('ndjson', 'csv'), default='ndjson')
+    parser_opts.add_argument('--props', metavar='PROP', help='properties to export instead of the defaults', nargs='+')
+    parser_opts.add_argument('--output', '-o', dest='output_path', help='write to a file instead of stdout')
+    parser_opts.add_argument('--page-size', dest='page_size', metavar='N', type=int, help='objects per retrieval page', default=config.get('page_size', 500))
+
+
+# Managed objects become their moid, data objects a mapping of their set properties, everything else something JSON and CSV can hold
+def plain(value):
+    if value is None or isinstance(value, (bool, int, long, float, basestring)):
+        return value
+    if hasattr(value, '_moId'):
+        return value._moId
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    if hasattr(value, '_GetPropertyList'):
+        return OrderedDict(
+            (p.name, plain(getattr(value, p.name)))
+            for p in value._GetPropertyList()
+            if p.name not in ('dynamicType', 'dynamicProperty') and getattr(value, p.name) is not None
+        )
+    return unicode(value)
+
+
+# CSV cells are UTF-8, lists are joined with ; and data objects written as JSON
+def cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ';'.join(cell(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return unicode(value).encode('utf-8')
+
+
+def func(args, config):
+    from pyVmomi import vim
+
+    type_name, prop_names = KINDS[args.kind]
+    if args.props:
+        prop_names = tuple(args.props)
+
+    # Records always carry the name, so columns match record fields only without it or repeats
+    prop_names = tuple(p for p in OrderedDict.fromkeys(prop_names) if p != 'name')
+
+    # Get VMware
+    vmware = get_vmware(args, config)
+
+    output = sys.stdout
+    if args.output_path:
+        try:
+            output = open(args.output_path, 'w')
+        except IOError as e:
+            raise CLIException('Could not write {}: {}'.format(args.output_path, e.strerror))
+
+    columns = ('moid', 'name') + prop_names
+    writer = None
+    if args.export_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(columns)
+
+    # Rows are written as pages arrive, flushed per page so the first rows show up early
+    count = 0
+    try:
+        for record in vmware.iter_objs(prop_names, getattr(vim, type_name), page_size=args.page_size):
+            values = [record.obj._moId, record.name] + [plain(v) for v in record[2:]]
+            if writer:
+                writer.writerow([cell(v) for v in values])
+            else:
+                output.write(json.dumps(OrderedDict(zip(columns, values))) + '\n')
+            count += 1
+            if count == 1 or not count % args.page_size:
+                output.flush()
+    finally:
+        output.flush()
+        if output is not sys.stdout:
+            output.close()
+
+    sys.stderr.write('Exported {} {}\n'.format(count, args.kind))
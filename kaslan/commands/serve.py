@@ -0,0 +1,61 @@
+from kaslan.commands import disable_prompt, get_vmware, reset_vmware
+from kaslan.daemon import DaemonServer
+import kaslan.commands
+import sys
+import threading
+
+DEFAULT_SOCKET = '~/.cache/kaslan/kaslan.sock'
+
+
+def cli_setup(subparsers, config):
+
+    # Serve parser
+    parser = subparsers.add_parser('serve', help='Run a daemon that keeps the vCenter session and caches warm')
+    parser.set_defaults(func=func)
+
+    # Serve: options
+    parser_opts = parser.add_argument_group('serve options')
+    parser_opts.add_argument('--socket', dest='socket_path', help='Unix socket path', default=config.get('socket_path', DEFAULT_SOCKET))
+    parser_opts.add_argument('--keepalive', metavar='SECONDS', type=int, help='touch the vCenter session this often, 0 to disable', default=config.get('keepalive_interval', 600))
+
+
+# vCenter logs out sessions idle for 30 minutes by default, a dead one is dropped between commands
+# so the next command logs in again, other failures are only reported
+def keep_alive(interval, stop, lock):
+    while not stop.wait(interval):
+        with lock:
+            vmware = kaslan.commands._vmware
+            if not vmware:
+                continue
+            try:
+                alive = vmware.keepalive()
+            except Exception as e:
+                sys.__stderr__.write('Keepalive failed: {}\n'.format(e))
+                continue
+            if not alive:
+                sys.__stderr__.write('vCenter session lost, reconnecting on the next command\n')
+                reset_vmware()
+
+
+def func(args, config):
+    from kaslan.cli import get_parser
+
+    # Login once up front, later logins cannot prompt inside the server
+    get_vmware(args, config)
+    disable_prompt()
+
+    server = DaemonServer(args.socket_path, get_parser(config), args, config)
+    print 'Listening on {}'.format(server.path)
+
+    stop = threading.Event()
+    if args.keepalive > 0:
+        keeper = threading.Thread(target=keep_alive, args=(args.keepalive, stop, server.lock), name='kaslan-keepalive')
+        keeper.daemon = True
+        keeper.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
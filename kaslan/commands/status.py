@@ -1,4 +1,5 @@
 from kaslan.commands import get_vmware
+from kaslan.exceptions import CLIException
 
 
 def cli_setup(subparsers, config):
@@ -9,20 +10,35 @@ def cli_setup(subparsers, config):
 
     # Status: arguments
     parser_args = parser.add_argument_group('status arguments')
-    parser_args.add_argument('vm_name', help='name of VM')
+    parser_args.add_argument('vm_names', metavar='vm_name', help='names of VMs, globs (web*) or regexes (re:^db[0-9]+$)', nargs='*')
 
     # Status: options
     parser_opts = parser.add_argument_group('status options')
     parser_opts.add_argument('--add', '-a', dest='status_add', metavar='COUNT', type=int, help='add status')
+    parser_opts.add_argument('--folder', dest='folder_path', help='only VMs under this folder path')
+    parser_opts.add_argument('--datacenter', dest='datacenter_name', help='datacenter of --folder')
+    parser_opts.add_argument('--cluster', dest='cluster_name', help='only VMs in this cluster')
 
 
 def func(args, config):
 
-    # Normalize
-    args.vm_name = args.vm_name.lower()
+    # Check if we have something to look for
+    if not any((args.vm_names, args.folder_path, args.cluster_name)):
+        raise CLIException('Require VM names, --folder or --cluster')
+
+    # Normalize, regexes are kept as given
+    args.vm_names = [n if n.startswith('re:') else n.lower() for n in args.vm_names]
 
     # Get VMware
     vmware = get_vmware(args, config)
 
-    # Get status
-    vmware.get_status(args.vm_name)
+    # Single VM keeps the detailed view
+    single = len(args.vm_names) == 1 and not args.vm_names[0].startswith('re:') and not any(c in args.vm_names[0] for c in '*?[')
+    if single and not any((args.folder_path, args.cluster_name)):
+        vmware.get_status(args.vm_names[0])
+        return
+
+    # Get status of all matches
+    vms, missing = vmware.get_fleet_status(args.vm_names, args.folder_path, args.datacenter_name, args.cluster_name)
+    if missing:
+        raise CLIException('{} VMs not found'.format(len(missing)))
@@ -0,0 +1,34 @@
+from kaslan.commands import get_vmware
+
+
+def cli_setup(subparsers, config):
+
+    # Sync parser
+    # Incremental syncs resume a collector that only outlives the run with session_cache or kaslan serve
+    parser = subparsers.add_parser('sync', help='Refresh the local inventory cache, incremental with session_cache or kaslan serve')
+    parser.set_defaults(func=func)
+
+    # Sync: options
+    parser_opts = parser.add_argument_group('sync options')
+    parser_opts.add_argument('--full', help='discard saved version and re-read the inventory', action='store_true', default=False)
+    parser_opts.add_argument('--wait', metavar='SECONDS', type=int, help='wait for changes if none are pending', default=0)
+
+
+def func(args, config):
+    from kaslan.sync import InventorySync
+
+    # Get VMware
+    vmware = get_vmware(args, config)
+
+    # Sync
+    result = InventorySync(vmware).sync(full=args.full, max_wait=args.wait)
+
+    print 'Sync        : {}'.format('full ({})'.format(result.reason) if result.full else 'incremental')
+    if result.reason == 'no session cache, collector lost at logout':
+        print 'Hint        : set session_cache in kaslan.yaml or run kaslan serve for incremental syncs'
+    print 'Objects     :'
+    for kind in sorted(set(result.stored.keys() + result.removed.keys())):
+        print '- {}: {} updated, {} removed'.format(kind, result.stored.get(kind, 0), result.removed.get(kind, 0))
+    print 'Updates     : {}'.format(result.updates)
+    print 'Received    : {}'.format(vmware.human_readable_b(result.bytes_received))
+    print 'Time        : {:.2f}s'.format(result.seconds)
@@ -0,0 +1,134 @@
+import socket
+import threading
+
+from pyVmomi import vim, vmodl
+from pyVmomi.SoapAdapter import SoapStubAdapter, StubAdapterBase
+
+# Objects vCenter only knows inside the session that created them
+SESSION_TYPES = (vim.view.View, vmodl.query.PropertyCollector, vmodl.query.PropertyCollector.Filter)
+
+# Calls whose specs name the objects they read
+SPEC_METHODS = ('RetrievePropertiesEx', 'RetrieveProperties', 'CreateFilter')
+TOKEN_METHODS = ('ContinueRetrievePropertiesEx', 'CancelRetrievePropertiesEx')
+DESTROY_METHODS = ('DestroyView', 'DestroyPropertyCollector', 'DestroyPropertyFilter')
+
+
+# gzip responses, enough pooled HTTP connections for every worker, kept alive while idle
+def tune_stub(stub, compression=True, connections=8, idle_timeout=900):
+    stub._acceptCompressedResponses = compression
+    stub.poolSize = max(stub.poolSize, connections)
+    stub.connectionPoolTimeout = idle_timeout
+    if not getattr(stub.scheme, 'keepalive', False):
+        stub.scheme = keepalive_scheme(stub.scheme)
+
+
+def keepalive_scheme(scheme):
+
+    def connection(*args, **kwargs):
+        conn = scheme(*args, **kwargs)
+        connect = conn.connect
+
+        # Idle pooled sockets are probed instead of silently dropped by firewalls
+        def keepalive_connect():
+            connect()
+            try:
+                conn.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (AttributeError, socket.error):
+                pass
+
+        conn.connect = keepalive_connect
+        return conn
+
+    connection.keepalive = True
+    return connection
+
+
+class SessionPool(StubAdapterBase):
+
+    # primary is a logged in stub, setup is called with every session stub before use
+    def __init__(self, primary, size, host, port, setup=None):
+        StubAdapterBase.__init__(self, version=primary.version)
+        self.primary = primary
+        self.size = max(size, 1)
+        self.host = host
+        self.port = int(port)
+        self.setup = setup
+        self.stubs = [primary]
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.assigned = 0
+
+        # Session scoped moids and retrieval tokens to the stub holding them
+        self.affinity = {}
+
+    @property
+    def cookie(self):
+        return self.primary.cookie
+
+    # Each thread sticks to one session, sessions are cloned on first use
+    def thread_stub(self):
+        stub = getattr(self.local, 'stub', None)
+        if stub is None:
+            with self.lock:
+                index = self.assigned % self.size
+                self.assigned += 1
+                if index == len(self.stubs):
+                    self.stubs.append(self.clone_session())
+                stub = self.stubs[index]
+            self.local.stub = stub
+        return stub
+
+    # New session from a ticket of the primary one, no password needed
+    def clone_session(self):
+        ticket = vim.ServiceInstance('ServiceInstance', self.primary).RetrieveContent().sessionManager.AcquireCloneTicket()
+        stub = SoapStubAdapter(host=self.host, port=self.port, version=self.primary.version)
+        if self.setup:
+            self.setup(stub)
+        vim.ServiceInstance('ServiceInstance', stub).RetrieveContent().sessionManager.CloneSession(ticket)
+        return stub
+
+    def route(self, mo, info, args):
+        keys = [mo._moId]
+        if info.wsdlName in TOKEN_METHODS:
+            keys.append(('token', args[0]))
+        elif info.wsdlName in SPEC_METHODS:
+            specs = args[0] if isinstance(args[0], list) else [args[0]]
+            keys.extend(o.obj._moId for s in specs for o in s.objectSet or ())
+        for key in keys:
+            stub = self.affinity.get(key)
+            if stub:
+                return stub
+        return self.thread_stub()
+
+    def remember(self, stub, mo, info, args, result):
+        if isinstance(result, SESSION_TYPES):
+            self.affinity[result._moId] = stub
+        elif info.wsdlName in DESTROY_METHODS:
+            self.affinity.pop(mo._moId, None)
+        if info.wsdlName in TOKEN_METHODS:
+            self.affinity.pop(('token', args[0]), None)
+        if info.wsdlName in ('RetrievePropertiesEx', 'ContinueRetrievePropertiesEx') and result and result.token:
+            self.affinity[('token', result.token)] = stub
+
+    def InvokeMethod(self, mo, info, args):
+        stub = self.route(mo, info, args)
+        status, result = stub.InvokeMethod(mo, info, args, self)
+        if status != 200:
+            raise result
+        self.remember(stub, mo, info, args, result)
+        return result
+
+    # Cloned sessions are always logged out, the primary one is left to the caller
+    def close(self):
+        with self.lock:
+            stubs, self.stubs = self.stubs[1:], self.stubs[:1]
+            self.size = 1
+        for stub in stubs:
+            try:
+                vim.ServiceInstance('ServiceInstance', stub).RetrieveContent().sessionManager.Logout()
+            except (IOError, vmodl.MethodFault):
+                pass
+            stub.DropConnections()
+        self.local = threading.local()
+        self.affinity.clear()
@@ -0,0 +1,156 @@
+from os.path import dirname, exists, expanduser, isdir
+import SocketServer
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from kaslan.exceptions import CLIException
+
+# Commands a running daemon will take
+COMMANDS = ('clone', 'compute', 'status', 'destroy', 'disks', 'datastore', 'sync')
+
+
+def send(wfile, msg):
+    wfile.write(json.dumps(msg) + '\n')
+    wfile.flush()
+
+
+class SocketWriter(object):
+
+    def __init__(self, wfile, stream):
+        self.wfile = wfile
+        self.stream = stream
+
+    def write(self, text):
+        send(self.wfile, {self.stream: text})
+
+    def flush(self):
+        self.wfile.flush()
+
+
+class SocketReader(object):
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+
+    # Prompts like raw_input are answered by the client
+    def readline(self):
+        send(self.wfile, {'input': True})
+        return json.loads(self.rfile.readline()).get('line', '')
+
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        self.server.run(request['argv'], self.rfile, self.wfile)
+
+
+class DaemonServer(SocketServer.UnixStreamServer):
+
+    def __init__(self, path, parser, args, config):
+        self.path = expanduser(path)
+        self.parser = parser
+
+        # Held while a command runs, the keepalive only resets the session between commands
+        self.lock = threading.Lock()
+        self.args = args
+        self.config = config
+
+        # Clear a stale socket, refuse to run twice
+        if not isdir(dirname(self.path)):
+            os.makedirs(dirname(self.path))
+        if exists(self.path):
+            sock = connect(self.path)
+            if sock:
+                sock.close()
+                raise CLIException('kaslan daemon already running on {}'.format(self.path))
+            os.remove(self.path)
+
+        old_umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, self.path, DaemonHandler)
+        finally:
+            os.umask(old_umask)
+
+    def run(self, argv, rfile, wfile):
+        with self.lock:
+            self.run_locked(argv, rfile, wfile)
+
+    def run_locked(self, argv, rfile, wfile):
+        start = time.time()
+        stdout, stderr, stdin = sys.stdout, sys.stderr, sys.stdin
+        sys.stdout = SocketWriter(wfile, 'out')
+        sys.stderr = SocketWriter(wfile, 'err')
+        sys.stdin = SocketReader(rfile, wfile)
+        try:
+            args = self.parser.parse_args(argv)
+
+            # Only serve commands for this daemon's session
+            if args.cmd not in COMMANDS:
+                return send(wfile, {'reject': 'command {} not served by daemon'.format(args.cmd)})
+            if (args.vcenter_host, args.vcenter_user) != (self.args.vcenter_host, self.args.vcenter_user):
+                return send(wfile, {'reject': 'daemon session is for {}@{}'.format(self.args.vcenter_user, self.args.vcenter_host)})
+
+            args.func(args, self.config)
+            code = 0
+        except SystemExit as e:
+            code = e.code or 0
+        except Exception as e:
+            sys.stderr.write('{}\n'.format(e))
+            code = 1
+        finally:
+            sys.stdout, sys.stderr, sys.stdin = stdout, stderr, stdin
+
+        send(wfile, {'exit': code, 'seconds': time.time() - start})
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if exists(self.path):
+            os.remove(self.path)
+
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(expanduser(path))
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+# Returns exit code, or None if the daemon is not available
+def forward(path, argv):
+    if not exists(expanduser(path)):
+        return None
+    sock = connect(path)
+    if not sock:
+        return None
+
+    rfile = sock.makefile('rb')
+    wfile = sock.makefile('wb', 0)
+    try:
+        send(wfile, {'argv': argv})
+        for line in iter(rfile.readline, ''):
+            msg = json.loads(line)
+            if 'out' in msg:
+                sys.stdout.write(msg['out'])
+            elif 'err' in msg:
+                sys.stderr.write(msg['err'])
+            elif 'input' in msg:
+                send(wfile, {'line': sys.stdin.readline()})
+            elif 'reject' in msg:
+                return None
+            elif 'exit' in msg:
+                return msg['exit']
+
+        # Daemon went away mid-command
+        raise CLIException('Lost connection to kaslan daemon on {}'.format(path))
+
+    finally:
+        sock.close()
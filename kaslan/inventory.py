@@ -0,0 +1,100 @@
+from os.path import expanduser, isdir, join
+import os
+import sqlite3
+import threading
+
+
+class InventoryIndex(object):
+
+    def __init__(self, host, cache_dir='~/.cache/kaslan'):
+        cache_dir = expanduser(cache_dir)
+        if not isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        # One database per vCenter
+        self.path = join(cache_dir, '{}.db'.format(host))
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS objects (kind TEXT, key TEXT, moid TEXT, PRIMARY KEY (kind, key, moid))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS objects_moid ON objects (kind, moid)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS portgroups (host_moid TEXT, host TEXT, vlan INTEGER, moid TEXT, key TEXT, switch_uuid TEXT)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS portgroups_host_vlan ON portgroups (host, vlan)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS portgroups_host_moid_vlan ON portgroups (host_moid, vlan)')
+
+    def lookup(self, kind, key):
+        with self.lock:
+            rows = self.db.execute('SELECT moid FROM objects WHERE kind = ? AND key = ?', (kind, key)).fetchall()
+        return [r[0] for r in rows]
+
+    def store(self, kind, key, moid):
+        self.store_many(kind, ((key, moid), ))
+
+    def store_many(self, kind, keys_and_moids):
+        with self.lock, self.db:
+            for key, moid in keys_and_moids:
+
+                # A moid has a single key per kind, drop the old one on rename
+                self.db.execute('DELETE FROM objects WHERE kind = ? AND moid = ?', (kind, moid))
+                self.db.execute('INSERT INTO objects (kind, key, moid) VALUES (?, ?, ?)', (kind, key, moid))
+
+    def remove(self, kind, moid):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM objects WHERE kind = ? AND moid = ?', (kind, moid))
+
+    def clear(self, kind=None):
+        with self.lock, self.db:
+            if kind:
+                self.db.execute('DELETE FROM objects WHERE kind = ?', (kind, ))
+            else:
+                self.db.execute('DELETE FROM objects')
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key, )).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.db:
+            if value is None:
+                self.db.execute('DELETE FROM meta WHERE key = ?', (key, ))
+            else:
+                self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    # rows are (host_moid, host, vlan, moid, key, switch_uuid), replaces the whole table
+    def store_portgroups(self, rows):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM portgroups')
+            self.db.executemany('INSERT INTO portgroups VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def lookup_portgroups(self, host, vlan, by_moid=False):
+        column = 'host_moid' if by_moid else 'host'
+        with self.lock:
+            return self.db.execute(
+                'SELECT moid, key, switch_uuid FROM portgroups WHERE {} = ? AND vlan = ?'.format(column),
+                (host, vlan)
+            ).fetchall()
+
+
+class FolderTrie(object):
+
+    # folders is (moid, name, parent_moid), roots are datacenter VM folder moids by datacenter name
+    def __init__(self, folders, roots):
+        self.children = {}
+        for moid, name, parent_moid in folders:
+            self.children.setdefault(parent_moid, {})[name] = moid
+        self.roots = dict(roots)
+
+    # Walks direct children from each root, or only the datacenter's, returns every matching folder moid
+    def resolve(self, path, datacenter_name=None):
+        matches = []
+        roots = self.roots.values() if datacenter_name is None else [self.roots.get(datacenter_name)]
+        for moid in roots:
+            for name in path.strip('/').split('/'):
+                moid = self.children.get(moid, {}).get(name)
+                if not moid:
+                    break
+            else:
+                matches.append(moid)
+        return matches
@@ -0,0 +1,70 @@
+import copy
+
+from netaddr import AddrFormatError, IPAddress, IPNetwork
+
+from kaslan.exceptions import CLIException
+
+
+class NetworkTable(object):
+
+    # networks is the kaslan.yaml mapping of CIDR to settings
+    def __init__(self, networks):
+        self.networks = networks
+
+        # Per (IP version, prefix length) hash of network address to settings
+        self.tables = {}
+        for cidr, settings in (networks or {}).iteritems():
+            network = IPNetwork(cidr)
+            items = copy.deepcopy(dict(settings or {}, subnet=str(network.netmask)))
+            self.tables.setdefault((network.version, network.prefixlen), {})[network.network.value] = (str(network.cidr), items)
+
+        # Longest prefixes are tried first so overlapping ranges pick the most specific
+        self.lengths = {}
+        for version, prefixlen in self.tables:
+            self.lengths.setdefault(version, []).append(prefixlen)
+        for version in self.lengths:
+            self.lengths[version].sort(reverse=True)
+
+    def __len__(self):
+        return sum(len(t) for t in self.tables.itervalues())
+
+    # Returns (cidr, settings) of the most specific network holding ip, settings is a deep copy callers may change
+    def lookup(self, ip):
+        try:
+            address = IPAddress(ip)
+        except (AddrFormatError, ValueError):
+            return None, None
+        width = address.version == 4 and 32 or 128
+        for prefixlen in self.lengths.get(address.version, ()):
+            key = address.value >> (width - prefixlen) << (width - prefixlen)
+            match = self.tables[(address.version, prefixlen)].get(key)
+            if match:
+                return match[0], copy.deepcopy(match[1])
+        return None, None
+
+
+# Compiled once and kept on the loaded config, plain dicts can't hold it and are compiled on every call
+def get_network_table(config):
+    networks = config.get('networks')
+    table = getattr(config, 'network_table', None)
+    if table is None or table.networks is not networks:
+        table = NetworkTable(networks)
+        try:
+            config.network_table = table
+        except AttributeError:
+            pass
+    return table
+
+
+def get_net_settings(ip, config):
+    cidr, net_settings = get_network_table(config).lookup(ip)
+
+    # Check if settings set
+    if net_settings is None:
+        raise CLIException('Network for {} not configured in kaslan.yaml'.format(ip))
+
+    # Check if all settings are given
+    if not all(k in net_settings for k in ('subnet', 'gateway', 'dns')):
+        raise CLIException('Network {} missing settings in kaslan.yaml'.format(cidr))
+
+    return net_settings
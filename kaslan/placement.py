@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import threading
+
+
+def most_free(ds, placement):
+    return -ds['free_space']
+
+
+def least_provisioned(ds, placement):
+    return ds['prov_perc']
+
+
+# Zero limits or capacity give no ratio instead of failing the placement
+def ratio(value, total):
+    return value / float(total) if total else 0.0
+
+
+# Weighs headroom against both limits and free space, lower is better
+def balanced(ds, placement):
+    return (
+        ratio(ds['prov_perc'], placement.prov_limit) +
+        ratio(ds['vm_count'], placement.vm_limit) -
+        ratio(ds['free_space'], ds['capacity'])
+    )
+
+
+# Fewest placements in this batch first, then most free
+def spread(ds, placement):
+    return (ds['reserved'], -ds['free_space'])
+
+
+STRATEGIES = {
+    'most_free': most_free,
+    'least_provisioned': least_provisioned,
+    'balanced': balanced,
+    'spread': spread,
+}
+
+
+class DatastorePlacement(object):
+
+    def __init__(self, datastores, ds_prefix, prov_limit, vm_limit, strategy='most_free'):
+        self.prov_limit = prov_limit
+        self.vm_limit = vm_limit
+        self.score = STRATEGIES[strategy]
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+
+        # Heap of acceptable candidates, ties keep datastore order
+        self.heap = []
+        self.datastores = {}
+        for ds in datastores:
+            if not ds['name'].startswith(ds_prefix):
+                continue
+            candidate = dict(ds, reserved=0, provisioned=ds['capacity'] * ds['prov_perc'] / 100.0)
+            self.datastores[candidate['name']] = candidate
+            self.push(candidate)
+
+    def acceptable(self, ds):
+        return ds['vm_count'] < self.vm_limit and ds['prov_perc'] < self.prov_limit
+
+    def push(self, ds):
+        if self.acceptable(ds):
+            heapq.heappush(self.heap, (self.score(ds, self), next(self.counter), ds))
+
+    def book(self, ds, size, count):
+        ds['free_space'] -= size
+        ds['provisioned'] += size
+        ds['prov_perc'] = ratio(ds['provisioned'], ds['capacity']) * 100
+        ds['vm_count'] += count
+        ds['reserved'] += count
+
+    # Picks the best datastore with size bytes free and books size bytes and one VM against it
+    def reserve(self, size=0):
+        with self.lock:
+
+            # Datastores too full for this clone stay candidates for smaller ones
+            skipped = []
+            ds = None
+            while self.heap:
+                entry = heapq.heappop(self.heap)
+                if entry[2]['free_space'] >= size:
+                    ds = entry[2]
+                    break
+                skipped.append(entry)
+            for entry in skipped:
+                heapq.heappush(self.heap, entry)
+            if not ds:
+                return None
+
+            # Back in the heap with its new score if it can take more
+            self.book(ds, size, 1)
+            self.push(ds)
+            return ds['name']
+
+    # Gives back what reserve booked for a clone that failed
+    def release(self, ds_name, size=0):
+        with self.lock:
+            ds = self.datastores.get(ds_name)
+            if not ds or not ds['reserved']:
+                return
+            self.book(ds, -size, -1)
+
+            # Rescored, it may also be acceptable again
+            self.heap = [entry for entry in self.heap if entry[2] is not ds]
+            heapq.heapify(self.heap)
+            self.push(ds)
@@ -0,0 +1,59 @@
+from os.path import expanduser, isdir, join
+import json
+import os
+
+from pyVim.connect import SetSi
+from pyVmomi import vim, vmodl
+from pyVmomi.SoapAdapter import SoapStubAdapter
+
+
+class SessionCache(object):
+
+    def __init__(self, host, port, user, cache_dir='~/.cache/kaslan'):
+        cache_dir = expanduser(cache_dir)
+        if not isdir(cache_dir):
+            os.makedirs(cache_dir, 0700)
+        self.host = host
+        self.port = int(port)
+        self.path = join(cache_dir, '{}@{}.session'.format(user, host))
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save(self, stub):
+        data = {'cookie': stub.cookie, 'version': stub.version}
+
+        # Session cookie is a credential, only owner can read it
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    # Returns a service instance on the saved session, None if it expired
+    def resume(self):
+        data = self.load()
+        if not data:
+            return None
+
+        stub = SoapStubAdapter(host=self.host, port=self.port, version=data['version'])
+        stub.cookie = data['cookie']
+        session = vim.ServiceInstance('ServiceInstance', stub)
+
+        try:
+            if not session.content.sessionManager.currentSession:
+                raise vim.fault.NotAuthenticated()
+        except (IOError, vmodl.MethodFault):
+            self.clear()
+            return None
+
+        SetSi(session)
+        return session
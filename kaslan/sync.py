@@ -0,0 +1,187 @@
+import hashlib
+import time
+
+from pyVmomi import vim, vmodl
+
+from kaslan.exceptions import VMwareException
+
+# Object types kept fresh in the inventory index
+SYNC_TYPES = (
+    vim.VirtualMachine,
+    vim.HostSystem,
+    vim.Datastore,
+    vim.dvs.DistributedVirtualPortgroup,
+)
+
+
+class SyncResult(object):
+
+    def __init__(self):
+        self.full = False
+        self.reason = None
+        self.updates = 0
+        self.stored = {}
+        self.removed = {}
+        self.bytes_received = 0
+        self.seconds = 0.0
+        self.version = None
+
+    def count(self, counts, kind):
+        counts[kind] = counts.get(kind, 0) + 1
+
+
+class InventorySync(object):
+
+    def __init__(self, vmware):
+        if not vmware.index:
+            raise VMwareException('Inventory sync requires the inventory cache, set inventory_cache in kaslan.yaml')
+        self.vmware = vmware
+        self.index = vmware.index
+        self.collector = None
+
+    def create_filter(self):
+        vmware = self.vmware
+
+        # Private collector so task waits never see inventory updates
+        collector = vmware.content.propertyCollector.CreatePropertyCollector()
+        view = vmware.content.viewManager.CreateContainerView(vmware.content.rootFolder, list(SYNC_TYPES), True)
+
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = view
+        obj_spec.skip = True
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec()
+        traversal_spec.type = view.__class__
+        traversal_spec.name = 'traversing'
+        traversal_spec.path = 'view'
+        traversal_spec.skip = False
+        obj_spec.selectSet = [traversal_spec]
+
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [obj_spec]
+        filter_spec.propSet = [
+            vmodl.query.PropertyCollector.PropertySpec(type=t, all=False, pathSet=['name'])
+            for t in SYNC_TYPES
+        ]
+        collector.CreateFilter(filter_spec, True)
+
+        # Remember server-side objects and the session owning them so the next run can resume
+        self.index.set_meta('sync_collector', collector._moId)
+        self.index.set_meta('sync_session', self.session_id())
+        self.index.set_meta('sync_view', view._moId)
+        self.index.set_meta('sync_version', None)
+        return collector
+
+    # Collectors die with their session, the cookie tells sessions apart without storing it
+    def session_id(self):
+        return hashlib.sha1(self.vmware.session._stub.cookie or '').hexdigest()
+
+    def get_collector(self):
+        if self.collector:
+            return self.collector
+
+        moid = self.index.get_meta('sync_collector')
+        if moid:
+            return vmodl.query.PropertyCollector(moid, self.vmware.session._stub)
+
+    def reset(self):
+        collector = self.get_collector()
+        if collector:
+            try:
+                collector.DestroyPropertyCollector()
+            except vmodl.fault.ManagedObjectNotFound:
+                pass
+        view_moid = self.index.get_meta('sync_view')
+        if view_moid:
+            try:
+                vim.view.ContainerView(view_moid, self.vmware.session._stub).Destroy()
+            except vmodl.fault.ManagedObjectNotFound:
+                pass
+        self.collector = None
+        for key in ('sync_collector', 'sync_session', 'sync_view', 'sync_version'):
+            self.index.set_meta(key, None)
+
+    def wait(self, collector, version, max_wait):
+        options = vmodl.query.PropertyCollector.WaitOptions()
+        options.maxWaitSeconds = max_wait
+        return collector.WaitForUpdatesEx(version, options)
+
+    def sync(self, full=False, max_wait=0):
+        result = SyncResult()
+        start = time.time()
+        bytes_start = self.vmware.wire.bytes_received
+
+        # Resume from the saved version, otherwise start over
+        collector = None if full else self.get_collector()
+        version = self.index.get_meta('sync_version')
+        update = None
+        if full:
+            result.reason = 'requested'
+        elif not collector or version is None:
+            result.reason = 'no saved collector'
+            collector = None
+
+        # Sessions not kept by the session cache or daemon log out, taking the collector with them
+        elif not self.collector and self.index.get_meta('sync_session') != self.session_id():
+            if self.vmware.session_cache:
+                result.reason = 'session expired, collector lost with it'
+            else:
+                result.reason = 'no session cache, collector lost at logout'
+            collector = None
+        else:
+            try:
+                update = self.wait(collector, version, max_wait)
+            except vmodl.fault.ManagedObjectNotFound:
+                result.reason = 'collector not found'
+                collector = None
+            except vmodl.query.InvalidCollectorVersion:
+                result.reason = 'saved version rejected'
+                collector = None
+
+        # Full sync rebuilds the index for synced types from the initial update
+        if not collector:
+            self.reset()
+            collector = self.create_filter()
+            for t in SYNC_TYPES:
+                self.index.clear(t._wsdlName)
+            result.full = True
+            version = ''
+            update = self.wait(collector, version, 0)
+        self.collector = collector
+
+        # Apply deltas, truncated updates continue right away
+        while update:
+            result.updates += 1
+            version = update.version
+            self.apply(update, result)
+            if not update.truncated:
+                break
+            update = self.wait(collector, version, 0)
+
+        self.index.set_meta('sync_version', version)
+        result.version = version
+        result.bytes_received = self.vmware.wire.bytes_received - bytes_start
+        result.seconds = time.time() - start
+        return result
+
+    def apply(self, update, result):
+        leave = vmodl.query.PropertyCollector.ObjectUpdate.Kind.leave
+        for filter_set in update.filterSet:
+            stored = {}
+            for obj_set in filter_set.objectSet:
+                kind = obj_set.obj._wsdlName
+
+                # Gone from inventory
+                if obj_set.kind == leave:
+                    self.index.remove(kind, obj_set.obj._moId)
+                    result.count(result.removed, kind)
+                    continue
+
+                # New or renamed
+                for change in obj_set.changeSet:
+                    if change.name == 'name':
+                        stored.setdefault(kind, []).append((change.val, obj_set.obj._moId))
+                        result.count(result.stored, kind)
+
+            for kind, names in stored.iteritems():
+                self.index.store_many(kind, names)
@@ -0,0 +1,202 @@
+from concurrent.futures import Future
+import Queue
+import threading
+
+from pyVmomi import vim, vmodl
+
+# Monitors by SOAP stub, tasks find theirs through task._stub
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+FINISHED = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+
+
+class TaskWatch(object):
+
+    def __init__(self, task):
+        self.task = task
+        self.state = None
+        self.progress = None
+        self.error = None
+        self.events = Queue.Queue()
+        self.future = Future()
+
+    def update(self, state, progress, error):
+        if state is not None:
+            self.state = state
+        if progress is not None:
+            self.progress = progress
+        if error is not None:
+            self.error = error
+        if self.state == vim.TaskInfo.State.error and self.error is None:
+            self.error = vmodl.RuntimeFault(msg='Task {} failed'.format(self.task._moId))
+        self.events.put((self.state, self.progress))
+
+        if self.state == vim.TaskInfo.State.success:
+            self.future.set_result(self.task)
+        elif self.state == vim.TaskInfo.State.error:
+            self.future.set_exception(self.error)
+
+    # Blocks caller and runs callbacks in its own thread
+    def wait(self, queued=None, running=None, success=None, error=None, progress=None, args=()):
+        last_state = None
+        while True:
+            # Short waits so Ctrl-C is not held up until the task changes
+            try:
+                state, percent = self.events.get(timeout=1)
+            except Queue.Empty:
+                continue
+            if state != last_state:
+                callback = {
+                    vim.TaskInfo.State.queued: queued,
+                    vim.TaskInfo.State.running: running,
+                    vim.TaskInfo.State.success: success,
+                    vim.TaskInfo.State.error: error,
+                }.get(state)
+                if callback:
+                    callback(self.task, *args)
+                last_state = state
+            elif progress and percent is not None:
+                progress(self.task, percent, *args)
+
+            if state == vim.TaskInfo.State.success:
+                return self.task
+            if state == vim.TaskInfo.State.error:
+                raise self.error
+
+
+class TaskMonitor(object):
+
+    def __init__(self, content, max_wait=30):
+        self.content = content
+        self.max_wait = max_wait
+        self.collector = None
+        self.view = None
+        self.watches = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @classmethod
+    def register(cls, stub, monitor):
+        with _monitors_lock:
+            _monitors[stub] = monitor
+
+    @classmethod
+    def for_stub(cls, stub):
+        with _monitors_lock:
+            if stub not in _monitors:
+                _monitors[stub] = cls(vim.ServiceInstance('ServiceInstance', stub).RetrieveContent())
+            return _monitors[stub]
+
+    # One collector and one filter over a list view, tasks are added and removed from the view
+    def create_filter(self):
+        self.collector = self.content.propertyCollector.CreatePropertyCollector()
+        self.view = self.content.viewManager.CreateListView([])
+
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = self.view
+        obj_spec.skip = True
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec()
+        traversal_spec.type = self.view.__class__
+        traversal_spec.name = 'traversing'
+        traversal_spec.path = 'view'
+        traversal_spec.skip = False
+        obj_spec.selectSet = [traversal_spec]
+
+        property_spec = vmodl.query.PropertyCollector.PropertySpec()
+        property_spec.type = vim.Task
+        property_spec.all = False
+        property_spec.pathSet = ['info.state', 'info.progress', 'info.error']
+
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [obj_spec]
+        filter_spec.propSet = [property_spec]
+        self.collector.CreateFilter(filter_spec, True)
+
+    def watch(self, task):
+        watch = TaskWatch(task)
+        with self.lock:
+            if not self.collector:
+                self.create_filter()
+            self.watches[task._moId] = watch
+            self.view.ModifyListView(add=[task])
+
+            # Watcher thread only runs while there are tasks
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, name='kaslan-task-monitor')
+                self.thread.daemon = True
+                self.thread.start()
+        return watch
+
+    def run(self):
+        version = ''
+        options = vmodl.query.PropertyCollector.WaitOptions()
+        options.maxWaitSeconds = self.max_wait
+        while True:
+            with self.lock:
+                if not self.watches:
+                    self.thread = None
+                    return
+
+            try:
+                update = self.collector.WaitForUpdatesEx(version, options)
+            except Exception as e:
+                self.fail(e)
+                return
+            if not update:
+                continue
+            version = update.version
+
+            finished = []
+            for filter_set in update.filterSet:
+                for obj_set in filter_set.objectSet:
+                    watch = self.watches.get(obj_set.obj._moId)
+                    if not watch:
+                        continue
+                    changes = {change.name: change.val for change in obj_set.changeSet}
+                    watch.update(changes.get('info.state'), changes.get('info.progress'), changes.get('info.error'))
+                    if watch.state in FINISHED:
+                        finished.append(watch)
+
+            # Finished tasks leave the filter, unless the monitor was closed once they finished
+            if finished:
+                with self.lock:
+                    for watch in finished:
+                        self.watches.pop(watch.task._moId, None)
+                    if self.view:
+                        self.view.ModifyListView(remove=[w.task for w in finished])
+
+    # Connection trouble fails every pending watch, always with a fault so callers can read its msg
+    def fail(self, error):
+        if not isinstance(error, vmodl.MethodFault):
+            error = vmodl.RuntimeFault(msg=str(error) or error.__class__.__name__)
+        with self.lock:
+            watches, self.watches = self.watches.values(), {}
+            self.thread = None
+        for watch in watches:
+            watch.update(vim.TaskInfo.State.error, None, error)
+
+    def close(self):
+        with self.lock:
+            collector, view = self.collector, self.view
+            self.collector = None
+            self.view = None
+
+            # The view goes even if the collector could not be destroyed
+            try:
+                if collector:
+                    collector.DestroyPropertyCollector()
+            except vmodl.fault.ManagedObjectNotFound:
+                pass
+            finally:
+                if view:
+                    try:
+                        view.Destroy()
+                    except vmodl.fault.ManagedObjectNotFound:
+                        pass
+
+        # A closed monitor is not handed out again
+        with _monitors_lock:
+            for stub in [s for s, m in _monitors.iteritems() if m is self]:
+                del _monitors[stub]
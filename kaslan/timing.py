@@ -0,0 +1,39 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import time
+
+# Phase name to seconds, in the order phases first ran
+_timings = OrderedDict()
+_lock = threading.Lock()
+
+
+# Phases can run on worker threads, e.g. clone prechecks or batch lines
+def record(name, seconds):
+    with _lock:
+        _timings[name] = _timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(name, time.time() - start)
+
+
+# Runs func timed under name, for work handed to an executor
+def call(name, func, *args, **kwargs):
+    with timed(name):
+        return func(*args, **kwargs)
+
+
+def report(total=None):
+    print 'Timing:'
+    with _lock:
+        timings = _timings.items()
+    for name, seconds in timings:
+        print '- {:<10} {:.3f}s'.format(name, seconds)
+    if total is not None:
+        print '- {:<10} {:.3f}s'.format('total', total)
@@ -1,46 +1,269 @@
 import atexit
+import fnmatch
+import re
 import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
 
 from tzlocal import get_localzone
-from pyVim.connect import SmartConnect, Disconnect, GetSi
+from pyVim.connect import SmartConnect, Disconnect
 from pyVmomi import vim, vmodl
 
+from kaslan import CLONE_MODES
+from kaslan.connection import SessionPool, tune_stub
 from kaslan.exceptions import VMwareException
+from kaslan.inventory import FolderTrie
+from kaslan.placement import DatastorePlacement
+from kaslan.tasks import TaskMonitor
+from kaslan.wire import WireCounter
 
 # Turn off SSL warning
 import requests
 requests.packages.urllib3.disable_warnings()
 
+# Template snapshot linked clones are made from
+BASE_SNAPSHOT = 'kaslan-base'
+
+# VM properties shown by status
+STATUS_PROPS = (
+    'config.hardware.numCPU',
+    'config.hardware.memoryMB',
+    'guest.guestState',
+    'guest.toolsStatus',
+    'guest.ipAddress',
+    'guest.hostName',
+    'config.guestFullName',
+    'config.version',
+    'runtime.bootTime',
+    'runtime.powerState',
+)
+
+# Objects prepare_clone reads and their properties, in the order it unpacks them
+CLONE_LOOKUPS = (
+    (vim.Datacenter, ('vmFolder', )),
+    (vim.ClusterComputeResource, ('resourcePool', 'host')),
+    (vim.Datastore, ()),
+    (vim.VirtualMachine, ('config.hardware.device', 'config.template', 'snapshot')),
+)
+
+
+class ViewPool(object):
+
+    # scope returns the session views are kept per, when there are several
+    def __init__(self, view_manager, max_views=16, scope=None):
+        self.view_manager = view_manager
+        self.max_views = max_views
+        self.scope = scope
+        self.views = OrderedDict()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.destroyed = 0
+
+    def get(self, root, obj_type):
+        with self.lock:
+            return self.get_locked(root, obj_type)
+
+    def get_locked(self, root, obj_type):
+        key = (root._moId, obj_type, self.scope and self.scope())
+
+        # Reuse existing view, otherwise create one
+        view = self.views.pop(key, None)
+        if view is not None:
+            self.reused += 1
+        else:
+            view = self.view_manager.CreateContainerView(root, [obj_type, ], True)
+            self.created += 1
 
-class VMware(object):
+        # Most recently used views are kept at the end
+        self.views[key] = view
+
+        # Evict least recently used views over the limit
+        while len(self.views) > self.max_views:
+            self.destroy_view(self.views.popitem(last=False)[1])
+
+        return view
 
-    def __init__(self, host, port, user, password):
+    def destroy_view(self, view):
         try:
-            self.session = SmartConnect(host=host, user=user, pwd=password, port=int(port))
-        except IOError:
-            raise VMwareException('Unable to create vCenter session {}:{}@{}'.format(host, port, user))
+            view.Destroy()
+        except vmodl.fault.ManagedObjectNotFound:
+            pass
+        self.destroyed += 1
+
+    def destroy_all(self):
+        with self.lock:
+            while self.views:
+                self.destroy_view(self.views.popitem(last=False)[1])
+
+    def stats(self):
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'destroyed': self.destroyed,
+            'active': len(self.views),
+        }
+
+
+class VMware(object):
+
+    # password can be a callable, only called if a login is needed
+    def __init__(self, host, port, user, password, max_views=16, page_size=500, index=None, session_cache=None, placement_ttl=300, portgroup_ttl=3600,
+                 sessions=1, connections=8, compression=True, idle_timeout=900):
+        self.session_cache = session_cache
+
+        # Reattach to a saved session
+        self.session = None
+        if session_cache:
+            try:
+                self.session = session_cache.resume()
+            except IOError:
+                self.session = None
+
+        # Login
+        if not self.session:
+            if callable(password):
+                password = password()
+            try:
+                self.session = SmartConnect(host=host, user=user, pwd=password, port=int(port))
+            except IOError:
+                raise VMwareException('Unable to create vCenter session {}:{}@{}'.format(host, port, user))
+            if session_cache:
+                session_cache.save(self.session._stub)
+
+        atexit.register(self.disconnect)
+        self.wire = WireCounter()
+
+        def setup(stub):
+            tune_stub(stub, compression=compression, connections=connections, idle_timeout=idle_timeout)
+            self.wire.install(stub)
+        setup(self.session._stub)
+
+        # Worker threads each get a session of their own, cloned from this one when first needed
+        self.pool = None
+        if sessions > 1:
+            self.pool = SessionPool(self.session._stub, sessions, host, port, setup=setup)
+            self.session = vim.ServiceInstance('ServiceInstance', self.pool)
 
-        atexit.register(Disconnect, self.session)
         self.content = self.session.RetrieveContent()
+        self.views = ViewPool(self.content.viewManager, max_views=max_views, scope=self.pool and self.pool.thread_stub)
+        self.tasks = TaskMonitor(self.content)
+        TaskMonitor.register(self.session._stub, self.tasks)
+        self.page_size = page_size
+        self.index = index
+
+        # Datastore placements shared by clones in this process
+        self.placements = {}
+        self.placements_lock = threading.Lock()
+        self.placement_ttl = placement_ttl
+        self.host_picks = {}
+
+        # (host, VLAN) to portgroup, in memory when there is no inventory index
+        self.portgroups = {}
+        self.portgroups_built = 0
+        self.portgroup_ttl = portgroup_ttl
+        self.folder_trie = None
+        self.snapshot_lock = threading.Lock()
+        self.record_types = {}
+
+    # Reading the current session resets the vCenter idle timer, False once any of our sessions is gone
+    def keepalive(self):
+        stubs = self.pool.stubs if self.pool else [self.session._stub]
+        for stub in list(stubs):
+            try:
+                if not vim.SessionManager(self.content.sessionManager._moId, stub).currentSession:
+                    return False
+            except vim.fault.NotAuthenticated:
+                return False
+        return True
+
+    def disconnect(self):
+        if not self.session:
+            return
 
+        # Views and collectors live server-side until destroyed
+        self.views.destroy_all()
+        self.tasks.close()
+        if self.pool:
+            self.pool.close()
 
-    # obj_names could be used instead of obj_filter
-    # if obj_filter provided, obj_names will be ignored
-    def get_obj(self, prop_names=None, obj_type=vim.VirtualMachine, obj_names=None, obj_filter=None, only_one=True, root=None):
+        # Cached sessions stay logged in for the next run
+        if not self.session_cache:
+            Disconnect(self.session)
+        (self.pool.primary if self.pool else self.session._stub).DropConnections()
+        self.session = None
 
-        # Setup defaults
+
+    def retrieve(self, filter_spec, page_size=None):
+        collector = self.content.propertyCollector
+        options = vmodl.query.PropertyCollector.RetrieveOptions()
+        options.maxObjects = page_size or self.page_size
+
+        # Stream pages, server keeps a token while more results are pending
+        token = None
+        try:
+            result = collector.RetrievePropertiesEx([filter_spec], options)
+            while result:
+                token = result.token
+                for obj in result.objects:
+                    yield obj
+                if not token:
+                    break
+                result = collector.ContinueRetrievePropertiesEx(token)
+            token = None
+
+        # Release server-side results if caller stopped early
+        finally:
+            if token:
+                collector.CancelRetrievePropertiesEx(token)
+
+    def get_props(self, obj, prop_names=None):
         if prop_names is None:
             prop_names = ()
-        if root is None:
-            root = self.content.rootFolder
 
-        # Setup filter
-        if not obj_filter and obj_names:
-            obj_filter = lambda props: props['name'] in obj_names
+        # Point straight at the object, no traversal
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = obj
+        obj_spec.skip = False
 
-        # Starting point
+        property_spec = vmodl.query.PropertyCollector.PropertySpec()
+        property_spec.type = obj.__class__
+        property_spec.all = False
+        property_spec.pathSet = list(set(tuple(prop_names) + ('name', )))
+
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [obj_spec]
+        filter_spec.propSet = [property_spec]
+
+        for o in self.retrieve(filter_spec):
+            properties = {prop.name: prop.val for prop in o.propSet}
+            properties['obj'] = o.obj
+            return properties
+
+    def get_cached(self, kind, key, obj_type, prop_names=None, check=None):
+        if not self.index:
+            return None
+
+        # Only trust an unambiguous entry
+        moids = self.index.lookup(kind, key)
+        if len(moids) != 1:
+            return None
+
+        # Stale entries are dropped so caller falls back to a live lookup
+        try:
+            obj = self.get_props(obj_type(moids[0], self.session._stub), prop_names)
+        except vmodl.fault.ManagedObjectNotFound:
+            obj = None
+        if not obj or (check and not check(obj)):
+            self.index.remove(kind, moids[0])
+            return None
+
+        return obj
+
+    def view_obj_spec(self, root, obj_type):
         obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
-        obj_spec.obj = self.content.viewManager.CreateContainerView(root, [obj_type, ], True)
+        obj_spec.obj = self.views.get(root, obj_type)
         obj_spec.skip = True
 
         # Define path for search
@@ -51,35 +274,183 @@ class VMware(object):
         traversal_spec.skip = False
         obj_spec.selectSet = [traversal_spec]
 
-        # Identify the properties to the retrieved
+        return obj_spec
+
+    # Names of every object of the given types under root, only names cross the wire
+    # returns (name, obj) pairs in retrieval order
+    def scan_names(self, obj_types, root=None):
+        if root is None:
+            root = self.content.rootFolder
+
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [self.view_obj_spec(root, t) for t in obj_types]
+        filter_spec.propSet = [
+            vmodl.query.PropertyCollector.PropertySpec(type=t, all=False, pathSet=['name'])
+            for t in obj_types
+        ]
+
+        names = []
+        seen = OrderedDict((t, []) for t in obj_types)
+        for obj in self.retrieve(filter_spec):
+            name = obj.propSet[0].val if obj.propSet else None
+            names.append((name, obj.obj))
+
+            # Every name we scan past is worth indexing
+            if self.index:
+                seen[next(t for t in obj_types if isinstance(obj.obj, t))].append((name, obj.obj._moId))
+
+        for obj_type, pairs in seen.iteritems():
+            if pairs:
+                self.index.store_many(obj_type._wsdlName, pairs)
+
+        return names
+
+    # objs is a list of (obj, prop_names), each read through its own object spec in one retrieval
+    # returns properties by moid
+    def read_objs(self, objs):
+        type_props = OrderedDict()
+        obj_specs = OrderedDict()
+        for obj, prop_names in objs:
+            type_props.setdefault(obj.__class__, set(('name', ))).update(prop_names or ())
+            obj_specs.setdefault(obj._moId, vmodl.query.PropertyCollector.ObjectSpec(obj=obj, skip=False))
+        if not obj_specs:
+            return {}
+
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = obj_specs.values()
+        filter_spec.propSet = [
+            vmodl.query.PropertyCollector.PropertySpec(type=t, all=False, pathSet=list(p))
+            for t, p in type_props.iteritems()
+        ]
+
+        by_moid = {}
+        for obj in self.retrieve(filter_spec):
+            properties = {prop.name: prop.val for prop in obj.propSet}
+            properties['obj'] = obj.obj
+            by_moid[obj.obj._moId] = properties
+        return by_moid
+
+    # lookups is a list of (obj_type, name, prop_names)
+    # returns properties for each lookup, in order
+    def get_objs(self, lookups):
+        stub = self.session._stub
+
+        # Indexed names point straight at the object
+        found = {}
+        for i, (obj_type, name, prop_names) in enumerate(lookups):
+            moids = self.index.lookup(obj_type._wsdlName, name) if self.index else []
+            if len(moids) == 1:
+                found[i] = obj_type(moids[0], stub)
+
+        while True:
+
+            # The rest are found by one name scan over every type still missing
+            missing = [i for i in range(len(lookups)) if i not in found]
+            if missing:
+                by_name = {}
+                for name, obj in self.scan_names(list(OrderedDict((lookups[i][0], None) for i in missing))):
+                    by_name.setdefault(name, []).append(obj)
+                for i in missing:
+                    obj_type, name = lookups[i][:2]
+                    objs = [o for o in by_name.get(name, ()) if isinstance(o, obj_type)]
+                    if len(objs) > 1:
+                        raise VMwareException('Found multiple {} objects named {}'.format(obj_type, name))
+                    elif not objs:
+                        raise VMwareException('Could not find {} object named {}'.format(obj_type, name))
+                    found[i] = objs[0]
+
+            # Only the matches are read in full
+            try:
+                by_moid = self.read_objs([(found[i], lookups[i][2]) for i in range(len(lookups))])
+            except vmodl.fault.ManagedObjectNotFound as e:
+                stale = [i for i, obj in found.iteritems() if obj._moId == e.obj._moId]
+                if not stale:
+                    raise
+                for i in stale:
+                    self.unindex(lookups[i][0], found.pop(i))
+                continue
+
+            # Stale or renamed index entries fall back to a scan
+            renamed = [i for i, obj in found.iteritems() if by_moid[obj._moId].get('name') != lookups[i][1]]
+            if not renamed:
+                break
+            for i in renamed:
+                self.unindex(lookups[i][0], found.pop(i))
+
+        return [by_moid[found[i]._moId] for i in range(len(lookups))]
+
+    def unindex(self, obj_type, obj):
+        if self.index:
+            self.index.remove(obj_type._wsdlName, obj._moId)
+
+    # Every object of a type under root with its properties, in one scan
+    def scan_objs(self, obj_type, prop_names=None, root=None):
+        if root is None:
+            root = self.content.rootFolder
+
         property_spec = vmodl.query.PropertyCollector.PropertySpec()
         property_spec.type = obj_type
         property_spec.all = False
-        property_spec.pathSet = list(set(tuple(prop_names) + ('name', )))
+        property_spec.pathSet = list(set(tuple(prop_names or ()) + ('name', )))
 
-        # Create filter specification
         filter_spec = vmodl.query.PropertyCollector.FilterSpec()
-        filter_spec.objectSet = [obj_spec]
+        filter_spec.objectSet = [self.view_obj_spec(root, obj_type)]
         filter_spec.propSet = [property_spec]
 
-        # Retrieve properties
-        collector = self.session.content.propertyCollector
-        objs = collector.RetrieveContents([filter_spec])
-
-        # Filter objects
         objs_and_props = []
-        for obj in objs:
-
-            # Compile propeties
+        for obj in self.retrieve(filter_spec):
             properties = {prop.name: prop.val for prop in obj.propSet}
+            properties['obj'] = obj.obj
+            objs_and_props.append(properties)
 
-            # If it fails filter, skip
-            if obj_filter and not obj_filter(properties):
+        # Every name we scan past is worth indexing
+        if self.index:
+            self.index.store_many(obj_type._wsdlName, [(p.get('name'), p['obj']._moId) for p in objs_and_props])
+
+        return objs_and_props
+
+    # Properties of objects found by a scan, objects deleted since are left out
+    def read_matched(self, objs, prop_names):
+        while objs:
+            try:
+                by_moid = self.read_objs([(obj, prop_names) for obj in objs])
+            except vmodl.fault.ManagedObjectNotFound as e:
+                if e.obj._moId not in set(obj._moId for obj in objs):
+                    raise
+                objs = [obj for obj in objs if obj._moId != e.obj._moId]
                 continue
+            return [by_moid[obj._moId] for obj in objs if obj._moId in by_moid]
+        return []
 
-            # Return this one with obj
-            properties['obj'] = obj.obj
-            objs_and_props.append(properties)
+    # obj_names could be used instead of obj_filter
+    # if obj_filter provided, obj_names will be ignored, it is given a dict with the name only
+    def get_obj(self, prop_names=None, obj_type=vim.VirtualMachine, obj_names=None, obj_filter=None, only_one=True, root=None):
+
+        # Setup defaults
+        if prop_names is None:
+            prop_names = ()
+
+        # Indexed lookup by name, index entries are not scoped to a root
+        if only_one and obj_names and len(obj_names) == 1 and not obj_filter and root is None:
+            name = obj_names[0]
+            obj = self.get_cached(obj_type._wsdlName, name, obj_type, prop_names, lambda props: props['name'] == name)
+            if obj:
+                return obj
+
+        # Setup filter
+        if not obj_filter and obj_names:
+            obj_filter = lambda props: props['name'] in obj_names
+
+        # Nothing to filter on, every object is read in the scan
+        if not obj_filter:
+            objs_and_props = self.scan_objs(obj_type, prop_names, root)
+
+        # Otherwise match on a name scan and read only the matches in full
+        else:
+            matched = [obj for name, obj in self.scan_names((obj_type, ), root) if obj_filter({'name': name})]
+            if only_one and len(matched) > 1:
+                raise VMwareException('Found multiple {} objects that match filter'.format(obj_type))
+            objs_and_props = self.read_matched(matched, prop_names)
 
         # If we only need one object, return first
         if only_one:
@@ -97,27 +468,262 @@ class VMware(object):
             else:
                 raise VMwareException('Unable to find {} objects that match filter'.format(obj_type))
 
-    def get_folder(self, path):
-        current_folder = None
-        for f in path.split('/'):
-            current_folder = self.get_obj(obj_type=vim.Folder, obj_names=(f,), root=current_folder)['obj']
-        return current_folder
+    # Record class per type and property set, fields are obj, name and the properties with . as _
+    # Fields that would repeat another (a.b and a_b) or are not identifiers are renamed to _<position>
+    def record_type(self, obj_type, prop_names):
+        key = (obj_type, tuple(prop_names))
+        if key not in self.record_types:
+            fields = ['obj', 'name'] + [p.replace('.', '_') for p in prop_names]
+            self.record_types[key] = namedtuple('{}Record'.format(obj_type._wsdlName), fields, rename=True)
+        return self.record_types[key]
+
+    # Yields compact records page by page, nothing is kept after a record is handed out
+    def iter_objs(self, prop_names=None, obj_type=vim.VirtualMachine, obj_filter=None, root=None, page_size=None):
+        prop_names = [p for p in OrderedDict.fromkeys(prop_names or ()) if p != 'name']
+        record = self.record_type(obj_type, prop_names)
+        if root is None:
+            root = self.content.rootFolder
 
-    def get_portgroup(self, vlan, host):
-        def vlan_host_filter(props):
+        property_spec = vmodl.query.PropertyCollector.PropertySpec()
+        property_spec.type = obj_type
+        property_spec.all = False
+        property_spec.pathSet = prop_names + ['name']
 
-            # If host is in this portgroup's collection of host, grab it if the vlan matches
-            if host in (h.name for h in props['host']):
-                return (props['config.defaultPortConfig'].vlan.vlanId == vlan)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [self.view_obj_spec(root, obj_type)]
+        filter_spec.propSet = [property_spec]
 
-            # Fallback to false
-            return False
+        for obj in self.retrieve(filter_spec, page_size):
+            properties = {prop.name: prop.val for prop in obj.propSet}
+            r = record(obj.obj, properties.get('name'), *[properties.get(p) for p in prop_names])
+            if obj_filter and not obj_filter(r):
+                continue
+            yield r
 
-        return self.get_obj(
-            prop_names=('host', 'config.defaultPortConfig'),
-            obj_type=vim.dvs.DistributedVirtualPortgroup,
-            obj_filter=vlan_host_filter
-        )['obj']
+    # One read of every folder and datacenter VM folder, kept for the session
+    def get_folder_trie(self):
+        if self.folder_trie:
+            return self.folder_trie
+
+        root = self.content.rootFolder
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [
+            self.view_obj_spec(root, vim.Folder),
+            self.view_obj_spec(root, vim.Datacenter),
+        ]
+        filter_spec.propSet = [
+            vmodl.query.PropertyCollector.PropertySpec(type=vim.Folder, pathSet=['name', 'parent']),
+            vmodl.query.PropertyCollector.PropertySpec(type=vim.Datacenter, pathSet=['name', 'vmFolder']),
+        ]
+
+        folders = []
+        roots = {}
+        for obj in self.retrieve(filter_spec):
+            props = {prop.name: prop.val for prop in obj.propSet}
+            if isinstance(obj.obj, vim.Datacenter):
+                roots[props['name']] = props['vmFolder']._moId
+            elif props.get('parent'):
+                folders.append((obj.obj._moId, props['name'], props['parent']._moId))
+
+        self.folder_trie = FolderTrie(folders, roots)
+        return self.folder_trie
+
+    # Datacenter name and path under its VM folder for a folder, read with its ancestors in one call
+    def get_folder_location(self, folder):
+        up = vmodl.query.PropertyCollector.TraversalSpec(name='up', type=vim.Folder, path='parent', skip=False)
+        up.selectSet = [vmodl.query.PropertyCollector.SelectionSpec(name='up')]
+
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [vmodl.query.PropertyCollector.ObjectSpec(obj=folder, skip=False, selectSet=[up])]
+        filter_spec.propSet = [
+            vmodl.query.PropertyCollector.PropertySpec(type=vim.Folder, pathSet=['name', 'parent']),
+            vmodl.query.PropertyCollector.PropertySpec(type=vim.Datacenter, pathSet=['name']),
+        ]
+        by_moid = {}
+        for obj in self.retrieve(filter_spec):
+            by_moid[obj.obj._moId] = dict((prop.name, prop.val) for prop in obj.propSet)
+
+        # Walk up to the datacenter, the last folder passed is its VM folder
+        names = []
+        moid = folder._moId
+        while moid in by_moid and 'parent' in by_moid[moid]:
+            names.append(by_moid[moid]['name'])
+            moid = by_moid[moid]['parent']._moId
+        if moid not in by_moid or not names:
+            return None, None
+        return by_moid[moid]['name'], '/'.join(reversed(names[:-1]))
+
+    # path is relative to a datacenter VM folder (e.g., Linux/Inbox)
+    def get_folder(self, path, datacenter_name=None):
+        path = path.strip('/')
+
+        # The same path can exist in several datacenters, so the index key names one when known
+        key = '{}/vm/{}'.format(datacenter_name, path) if datacenter_name else path
+        moids = self.index.lookup('FolderPath', key) if self.index else []
+        if len(moids) == 1:
+            folder = vim.Folder(moids[0], self.session._stub)
+            try:
+                datacenter, folder_path = self.get_folder_location(folder)
+            except vmodl.fault.ManagedObjectNotFound:
+                datacenter, folder_path = None, None
+
+            # Cached folder must still be at path, under the asked datacenter
+            if datacenter and folder_path == path and datacenter_name in (None, datacenter):
+                return folder
+            self.index.remove('FolderPath', moids[0])
+
+        # Inventory path when we know the datacenter, otherwise the folder trie
+        folder = None
+        if datacenter_name:
+            folder = self.content.searchIndex.FindByInventoryPath('{}/vm/{}'.format(datacenter_name, path))
+        if not isinstance(folder, vim.Folder):
+            matches = self.get_folder_trie().resolve(path, datacenter_name)
+            if len(matches) > 1:
+                raise VMwareException('Found multiple folders with path {}'.format(path))
+            elif not matches:
+                raise VMwareException('Could not find folder with path {}'.format(path))
+            folder = vim.Folder(matches[0], self.session._stub)
+
+        if self.index:
+            self.index.store('FolderPath', key, folder._moId)
+        return folder
+
+    # One bulk read of every DV portgroup, host and switch
+    def get_portgroup_rows(self):
+        root = self.content.rootFolder
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [
+            self.view_obj_spec(root, vim.dvs.DistributedVirtualPortgroup),
+            self.view_obj_spec(root, vim.HostSystem),
+            self.view_obj_spec(root, vim.DistributedVirtualSwitch),
+        ]
+        filter_spec.propSet = [
+            vmodl.query.PropertyCollector.PropertySpec(
+                type=vim.dvs.DistributedVirtualPortgroup,
+                pathSet=['key', 'host', 'config.defaultPortConfig', 'config.distributedVirtualSwitch']
+            ),
+            vmodl.query.PropertyCollector.PropertySpec(type=vim.HostSystem, pathSet=['name']),
+            vmodl.query.PropertyCollector.PropertySpec(type=vim.DistributedVirtualSwitch, pathSet=['uuid']),
+        ]
+
+        portgroups = []
+        names = {}
+        for obj in self.retrieve(filter_spec):
+            props = {prop.name: prop.val for prop in obj.propSet}
+            if isinstance(obj.obj, vim.dvs.DistributedVirtualPortgroup):
+                portgroups.append((obj.obj._moId, props))
+            else:
+                names[obj.obj._moId] = props.get('name', props.get('uuid'))
+
+        # Expand to one row per (host, VLAN), trunk portgroups have no single VLAN
+        rows = []
+        for moid, props in portgroups:
+            vlan = getattr(props.get('config.defaultPortConfig'), 'vlan', None)
+            vlan_id = getattr(vlan, 'vlanId', None)
+            if not isinstance(vlan_id, int):
+                continue
+            switch_uuid = names.get(getattr(props.get('config.distributedVirtualSwitch'), '_moId', None))
+            for h in props.get('host', ()):
+                rows.append((h._moId, names.get(h._moId), vlan_id, moid, props['key'], switch_uuid))
+
+        return rows
+
+    def refresh_portgroups(self):
+        rows = self.get_portgroup_rows()
+        if self.index:
+            self.index.store_portgroups(rows)
+            self.index.set_meta('portgroups_built', str(time.time()))
+        else:
+            self.portgroups = {}
+            for host_moid, host, vlan, moid, key, switch_uuid in rows:
+                for h in (host_moid, host):
+                    self.portgroups.setdefault((h, vlan), []).append((moid, key, switch_uuid))
+        self.portgroups_built = time.time()
+
+    def lookup_portgroups(self, host, vlan):
+        by_moid = isinstance(host, vim.HostSystem)
+        host_key = host._moId if by_moid else host
+        if self.index:
+            return self.index.lookup_portgroups(host_key, vlan, by_moid=by_moid)
+        return self.portgroups.get((host_key, vlan), [])
+
+    # Builds (host, VLAN) index when missing or old, returns True if it was already fresh
+    def ensure_portgroups(self):
+        if not self.portgroups_built and self.index:
+            self.portgroups_built = float(self.index.get_meta('portgroups_built', 0))
+        if time.time() - self.portgroups_built < self.portgroup_ttl:
+            return True
+        self.refresh_portgroups()
+        return False
+
+    def portgroup_props(self, match):
+        moid, key, switch_uuid = match
+        return {
+            'obj': vim.dvs.DistributedVirtualPortgroup(moid, self.session._stub),
+            'key': key,
+            'switch_uuid': switch_uuid,
+        }
+
+    # host is a HostSystem or a host name
+    def get_portgroup(self, vlan, host):
+        fresh = self.ensure_portgroups()
+
+        # Missing entry may be a new portgroup
+        matches = self.lookup_portgroups(host, vlan)
+        if not matches and fresh:
+            self.refresh_portgroups()
+            matches = self.lookup_portgroups(host, vlan)
+
+        if len(matches) > 1:
+            raise VMwareException('Found multiple portgroups for VLAN {} on host {}'.format(vlan, host))
+        elif not matches:
+            raise VMwareException('Could not find portgroup for VLAN {} on host {}'.format(vlan, host))
+
+        return self.portgroup_props(matches[0])
+
+    # Portgroup for a VLAN across cluster hosts, with the host to pin to when not every host has it
+    # returns (None, None) when no host has it
+    def get_cluster_portgroup(self, vlan, hosts):
+        self.ensure_portgroups()
+
+        by_host = {}
+        for h in hosts:
+            matches = self.lookup_portgroups(h, vlan)
+            if len(matches) == 1:
+                by_host[h._moId] = matches[0]
+        if not by_host:
+            return None, None
+
+        # Same portgroup on every host leaves placement to DRS
+        if len(by_host) == len(hosts) and len(set(by_host.values())) == 1:
+            return self.portgroup_props(by_host.values()[0]), None
+
+        # Round robin over the hosts that have it, so clones in this process do not all land on one
+        with self.placements_lock:
+            host_moid = min(by_host, key=lambda moid: (self.host_picks.get(moid, 0), moid))
+            self.host_picks[host_moid] = self.host_picks.get(host_moid, 0) + 1
+        return self.portgroup_props(by_host[host_moid]), vim.HostSystem(host_moid, self.session._stub)
+
+    # Edit spec that moves the first NIC onto a DV portgroup
+    def nic_device_change(self, devices, network):
+        nic = vim.vm.device.VirtualDeviceSpec()
+        nic.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+        for device in devices:
+            if isinstance(device, vim.vm.device.VirtualEthernetCard):
+                nic.device = device
+                break
+        else:
+            return None
+        nic.device.wakeOnLanEnabled = True
+        portgroup_connection = vim.dvs.PortConnection()
+        portgroup_connection.portgroupKey = network['key']
+        portgroup_connection.switchUuid = network['switch_uuid']
+        nic.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+        nic.device.backing.port = portgroup_connection
+        nic.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
+        nic.device.connectable.startConnected = True
+        nic.device.connectable.allowGuestControl = True
+        return nic
 
     def new_start_task(self, task, task_tag=''):
 
@@ -147,7 +753,7 @@ class VMware(object):
             )
 
         except Exception as e:
-            print '\nException: {}'.format(e.msg)
+            print '\nException: {}'.format(getattr(e, 'msg', e))
             if hint_msg:
                 print 'Hint: {}'.format(hint_msg)
             return False
@@ -197,51 +803,83 @@ class VMware(object):
             bytes /= 1024.0
         return "%3.1f%s" % (bytes, 'TB')
 
-    def get_cluster_datastores(self, cluster, ds_prefix):
-        cluster_datastores = self.get_obj(
-            obj_names=(cluster,),
-            prop_names=(
-                'datastore',
-            ),
-            obj_type=vim.ClusterComputeResource,
-            only_one=True
-        )
+    # Datastore stats for a cluster, summary and vm of every datastore in one traversal
+    def get_cluster_datastore_stats(self, cluster):
+        cluster_obj = self.get_objs((
+            (vim.ClusterComputeResource, cluster, ()),
+        ))[0]['obj']
+
+        # Start at the cluster, follow its datastore property
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = cluster_obj
+        obj_spec.skip = True
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec()
+        traversal_spec.type = vim.ClusterComputeResource
+        traversal_spec.name = 'datastores'
+        traversal_spec.path = 'datastore'
+        traversal_spec.skip = False
+        obj_spec.selectSet = [traversal_spec]
+
+        property_spec = vmodl.query.PropertyCollector.PropertySpec()
+        property_spec.type = vim.Datastore
+        property_spec.all = False
+        property_spec.pathSet = ['summary', 'vm']
 
-        for ds in cluster_datastores['datastore']:
-            if not ds.summary.name.startswith(ds_prefix):
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [obj_spec]
+        filter_spec.propSet = [property_spec]
+
+        datastores = []
+        for obj in self.retrieve(filter_spec):
+            props = {prop.name: prop.val for prop in obj.propSet}
+            summary = props['summary']
+
+            # Inaccessible datastores report no capacity and can't take a clone
+            if not summary.capacity:
                 continue
 
-            space_free = self.human_readable_b(ds.summary.freeSpace or 0)
-            space_total = self.human_readable_b(ds.summary.capacity)
-            space_overprov = (ds.summary.uncommitted or 0) - (ds.summary.freeSpace or 0)
-            percent_prov = ((ds.summary.capacity + space_overprov) / float(ds.summary.capacity)) * 100
+            # Calculate provision percentage
+            free_space = summary.freeSpace or 0
+            prov_space = (summary.uncommitted or 0) - free_space
+            prov_perc = ((summary.capacity + prov_space) / float(summary.capacity)) * 100
+
+            datastores.append({
+                'obj': obj.obj,
+                'name': summary.name,
+                'vm_count': len(props.get('vm', ())),
+                'free_space': free_space,
+                'capacity': summary.capacity,
+                'prov_perc': prov_perc,
+            })
+
+        return datastores
+
+    def get_cluster_datastores(self, cluster, ds_prefix):
+        for ds in self.get_cluster_datastore_stats(cluster):
+            if not ds['name'].startswith(ds_prefix):
+                continue
+
+            space_free = self.human_readable_b(ds['free_space'])
+            space_total = self.human_readable_b(ds['capacity'])
 
             print '======================'
-            print 'Name: {}'.format(ds.summary.name)
+            print 'Name: {}'.format(ds['name'])
             print 'Space free: {}/{}'.format(space_free, space_total)
-            print 'Space provisioned: {:.2f}%'.format(percent_prov)
-            print 'VM count: {}'.format(len(ds.vm))
+            print 'Space provisioned: {:.2f}%'.format(ds['prov_perc'])
+            print 'VM count: {}'.format(ds['vm_count'])
 
     def summarize_cluster_datastores(self, cluster, ds_prefix):
-        cluster_datastores = self.get_obj(
-            obj_names=(cluster,),
-            prop_names=(
-                'datastore',
-            ),
-            obj_type=vim.ClusterComputeResource,
-            only_one=True
-        )
-
         ds_prefixes = []
-        for ds in cluster_datastores['datastore']:
+        for ds in self.get_cluster_datastore_stats(cluster):
 
             # Skip anything not matching prefix
-            if not ds.summary.name.startswith(ds_prefix):
-                print ds.summary.name
+            if not ds['name'].startswith(ds_prefix):
+                print ds['name']
                 continue
 
             # Strip numbers dashes and undercores from end
-            this_prefix = ds.summary.name.rstrip('._-1234567890')
+            this_prefix = ds['name'].rstrip('._-1234567890')
             if this_prefix not in ds_prefixes:
                 ds_prefixes.append(this_prefix)
 
@@ -252,48 +890,38 @@ class VMware(object):
             for ds in sorted(ds_prefixes):
                 print '- {}'.format(ds)
 
-    def choose_a_datastore(self, cluster, ds_prefix, prov_limit, vm_limit):
-        cluster_datastores = self.get_obj(
-            obj_names=(cluster,),
-            prop_names=(
-                'datastore',
-            ),
-            obj_type=vim.ClusterComputeResource,
-            only_one=True
-        )
-        acceptable_ds = []
-        for ds in cluster_datastores['datastore']:
-
-            # Get name and check if it has prefix
-            ds_name = ds.summary.name
-            if not ds_name.startswith(ds_prefix):
-                continue
-
-            # Get VM count and only continue if under limit
-            vm_count = len(ds.vm)
-            if vm_count >= vm_limit:
-                continue
-
-            # Getting free space now since used for later calc
-            free_space = ds.summary.freeSpace or 0
+    def get_template_size(self, template_name):
+        template_vm = self.get_objs((
+            (vim.VirtualMachine, template_name, ('summary.storage', )),
+        ))[0]
+        storage = template_vm['summary.storage']
+        return (storage.committed or 0) + (storage.uncommitted or 0)
+
+    def get_placement(self, cluster, ds_prefix, prov_limit, vm_limit, strategy='most_free'):
+        key = (cluster, ds_prefix, prov_limit, vm_limit, strategy)
+
+        # Query vCenter once per batch, not per clone
+        with self.placements_lock:
+            placement, created = self.placements.get(key, (None, 0))
+            if not placement or time.time() - created > self.placement_ttl:
+                placement = DatastorePlacement(
+                    self.get_cluster_datastore_stats(cluster),
+                    ds_prefix,
+                    prov_limit,
+                    vm_limit,
+                    strategy
+                )
+                self.placements[key] = (placement, time.time())
 
-            # Calculate provision percentage
-            prov_space = (ds.summary.uncommitted or 0) - free_space
-            prov_perc = ((ds.summary.capacity + prov_space) / float(ds.summary.capacity)) * 100
-            if prov_perc >= prov_limit:
-                continue
+        return placement
 
-            # ASSERT: meets limits
-
-            acceptable_ds.append({
-                'name': ds_name,
-                'vm_count': vm_count,
-                'free_space': free_space,
-                'prov_perc': prov_perc,
-            })
+    # size is reserved against the chosen datastore so later clones in this process spread out
+    def choose_a_datastore(self, cluster, ds_prefix, prov_limit, vm_limit, strategy='most_free', size=0):
+        placement = self.get_placement(cluster, ds_prefix, prov_limit, vm_limit, strategy)
+        ds_name = placement.reserve(size)
 
         #  Check if we found a datastore
-        if not len(acceptable_ds):
+        if not ds_name:
             raise VMwareException(
                 'Could not find a {} datastore with {} perfix that has less than {} VMs and is under {:.0f}% provisioned '.format(
                     cluster,
@@ -303,29 +931,22 @@ class VMware(object):
                 )
             )
 
-        # Get DS with highest free space
-        highest_free = sorted(acceptable_ds, key=lambda ds: ds['free_space'])[0]['name']
-        return highest_free
+        return ds_name
+
+    # A failed clone gives back its booking, on the placement get_placement would hand out now
+    def release_datastore(self, ds_name, cluster, ds_prefix, prov_limit, vm_limit, strategy='most_free', size=0):
+        with self.placements_lock:
+            placement = self.placements.get((cluster, ds_prefix, prov_limit, vm_limit, strategy), (None, 0))[0]
+        if placement:
+            placement.release(ds_name, size)
 
     def verify_datastore(self, cluster, ds):
         pass
 
     def get_status(self, vm_name):
-        vm = self.get_obj(
-            obj_names=(vm_name, ),
-            prop_names=(
-                'config.hardware.numCPU',
-                'config.hardware.memoryMB',
-                'guest.guestState',
-                'guest.toolsStatus',
-                'guest.ipAddress',
-                'guest.hostName',
-                'config.guestFullName',
-                'config.version',
-                'runtime.bootTime',
-                'runtime.powerState',
-            )
-        )
+        vm = self.get_objs((
+            (vim.VirtualMachine, vm_name, STATUS_PROPS),
+        ))[0]
 
         print 'Hostname    : {}'.format(vm['guest.hostName'])
         print 'OS          : {}'.format(vm['config.guestFullName'])
@@ -340,6 +961,69 @@ class VMware(object):
             boot_time = vm['runtime.bootTime'].astimezone(get_localzone()).strftime('%m/%d/%Y %H:%M')
             print 'Last Boot   : {}'.format(boot_time)
 
+    # patterns are names, globs or re:<regex>, scoped to a folder or cluster if given
+    # returns (VM properties sorted by name, literal names not found)
+    def get_statuses(self, patterns, folder_path=None, datacenter_name=None, cluster_name=None):
+        names = set(p for p in patterns if not p.startswith('re:') and not any(c in p for c in '*?['))
+        globs = [p for p in patterns if p not in names and not p.startswith('re:')]
+        regexes = [re.compile(p[3:]) for p in patterns if p.startswith('re:')]
+
+        # Only names and no scope, indexed names are read directly
+        root = None
+        if folder_path:
+            root = self.get_folder(folder_path, datacenter_name)
+        elif cluster_name:
+            root = self.get_objs(((vim.ClusterComputeResource, cluster_name, ()), ))[0]['obj']
+        vms = None
+        if names and not globs and not regexes and root is None:
+            try:
+                vms = self.get_objs([(vim.VirtualMachine, n, STATUS_PROPS) for n in sorted(names)])
+            except VMwareException:
+                vms = None
+
+        # Otherwise one name scan matches every pattern, no patterns reads everything in scope
+        if vms is None:
+            def matches(props):
+                name = props['name']
+                return (
+                    name in names or
+                    any(fnmatch.fnmatchcase(name, g) for g in globs) or
+                    any(r.search(name) for r in regexes)
+                )
+            try:
+                vms = self.get_obj(prop_names=STATUS_PROPS, obj_filter=matches if patterns else None, only_one=False, root=root)
+            except VMwareException:
+                vms = []
+
+        found = set(vm['name'] for vm in vms)
+        return sorted(vms, key=lambda vm: vm['name']), sorted(names - found)
+
+    def get_fleet_status(self, patterns, folder_path=None, datacenter_name=None, cluster_name=None):
+        vms, missing = self.get_statuses(patterns, folder_path, datacenter_name, cluster_name)
+
+        row = '{:<30} {:<11} {:<12} {:<18} {:<16} {:>4} {:>8} {:<16}'
+        print row.format('Name', 'Power', 'Guest', 'Tools', 'IP Address', 'CPUs', 'Memory', 'Last Boot').rstrip()
+        for vm in vms:
+            boot_time = ''
+            if vm.get('runtime.bootTime'):
+                boot_time = vm['runtime.bootTime'].astimezone(get_localzone()).strftime('%m/%d/%Y %H:%M')
+            print row.format(
+                vm['name'],
+                vm.get('runtime.powerState', ''),
+                vm.get('guest.guestState', ''),
+                vm.get('guest.toolsStatus', ''),
+                vm.get('guest.ipAddress') or '',
+                vm.get('config.hardware.numCPU', ''),
+                '{:.1f}GB'.format(vm.get('config.hardware.memoryMB', 0) / 1024.0),
+                boot_time
+            ).rstrip()
+        print ''
+        print 'VMs         : {}'.format(len(vms))
+        for name in missing:
+            print 'Not found   : {}'.format(name)
+
+        return vms, missing
+
     def destroy(self, vm_name):
         vm = self.get_obj(
             obj_names=(vm_name, ),
@@ -351,7 +1035,8 @@ class VMware(object):
             print 'Turning off VM before deleting...'
             self.start_task(vm['obj'].PowerOff(), success_msg='VM turned off, deleting from disk now...')
 
-        self.start_task(vm['obj'].Destroy(), success_msg='VM {} has been destroyed'.format(vm_name))
+        if self.start_task(vm['obj'].Destroy(), success_msg='VM {} has been destroyed'.format(vm_name)) and self.index:
+            self.index.remove(vim.VirtualMachine._wsdlName, vm['obj']._moId)
 
     def clone(
         self,
@@ -369,23 +1054,80 @@ class VMware(object):
         subnet,
         gateway,
         folder_path=None,
+        clone_mode='full',
         *args,
         **kwargs
     ):
-        # Find objects
-        datacenter = self.get_obj(obj_type=vim.Datacenter, obj_names=(datacenter_name))
-        cluster = self.get_obj(obj_type=vim.ClusterComputeResource, obj_names=(cluster_name))
-        datastore = self.get_obj(obj_type=vim.Datastore, obj_names=(ds_name,))
-        template_vm = self.get_obj(obj_names=(template_name,))
+        template_vm, folder, clonespec, networked = self.prepare_clone(
+            template_name, vm_name, cpus, memory, datacenter_name, cluster_name, ds_name,
+            ip, domain, dns, vlan, subnet, gateway, folder_path, clone_mode
+        )
+
+        # Create task
+        task = self.start_clone(template_vm, folder, vm_name, clonespec)
+        result = self.start_task(
+            task,
+            task_tag='Cloning',
+            success_msg='Cloned in folder {}'.format(folder_path),
+            last_task=False
+        )
+
+        # Do not continue if we didn't get clone
+        if not result:
+            return False
+
+        # Change networking if the clone spec could not
+        self.index_clone(vm_name, task)
+        if not networked:
+            self.start_task(
+                self.reconfigure_network(vm_name, vlan, task.info.result),
+                task_tag='Networking',
+                success_msg='VIF reconfigured'
+            )
+        return True
+
+    def prepare_clone(
+        self,
+        template_name,
+        vm_name,
+        cpus,
+        memory,
+        datacenter_name,
+        cluster_name,
+        ds_name,
+        ip,
+        domain,
+        dns,
+        vlan,
+        subnet,
+        gateway,
+        folder_path=None,
+        clone_mode='full',
+        resolved=None,
+        folder=None,
+        *args,
+        **kwargs
+    ):
+        if clone_mode not in CLONE_MODES:
+            raise VMwareException('Unknown clone mode {}'.format(clone_mode))
+
+        # Objects resolved by the caller are keyed by (type, name) and read with CLONE_LOOKUPS properties, the rest in one round trip
+        resolved = resolved or {}
+        names = (datacenter_name, cluster_name, ds_name, template_name)
+        lookups = [(obj_type, name, props) for (obj_type, props), name in zip(CLONE_LOOKUPS, names)]
+        missing = [l for l in lookups if l[:2] not in resolved]
+        found = dict(zip([l[:2] for l in missing], self.get_objs(missing))) if missing else {}
+        datacenter, cluster, datastore, template_vm = [found.get(l[:2]) or resolved[l[:2]] for l in lookups]
 
         # Get folder, defaults to datacenter
-        if folder_path:
-            folder = self.get_folder(folder_path)
-        else:
-            folder = datacenter['obj'].vmFolder
+        if folder is None:
+            if folder_path:
+                folder = self.get_folder(folder_path, datacenter_name)
+            else:
+                folder = datacenter['vmFolder']
 
         # Default objects
-        resource_pool = cluster['obj'].resourcePool
+        resource_pool = cluster['resourcePool']
 
         # Relocation specs
         relospec = vim.vm.RelocateSpec()
@@ -399,6 +1141,26 @@ class VMware(object):
         vmconf.cpuHotAddEnabled = True
         vmconf.memoryHotAddEnabled = True
 
+        # NIC goes in the clone spec when we know a host that has the portgroup
+        network, host = self.get_cluster_portgroup(vlan, cluster.get('host', ()))
+        nic = None
+        if network:
+            nic = self.nic_device_change(template_vm['config.hardware.device'], network)
+        if nic:
+            vmconf.deviceChange = [nic, ]
+            if host:
+                relospec.host = host
+
+        # Instant clones fork the running source VM
+        if clone_mode == 'instant':
+            relospec.folder = folder
+            clonespec = self.instant_clone_spec(vm_name, relospec, nic, ip, domain, dns, subnet, gateway)
+            return template_vm['obj'], folder, clonespec, bool(nic)
+
+        # Linked clones share the base snapshot disks
+        if clone_mode == 'linked':
+            relospec.diskMoveType = vim.vm.RelocateSpec.DiskMoveOptions.createNewChildDiskBacking
+
         # NIC mapping
         nic_map = vim.vm.customization.AdapterMapping()
         nic_map.adapter = vim.vm.customization.IPSettings()
@@ -432,113 +1194,128 @@ class VMware(object):
         clonespec.customization = customspec
         clonespec.powerOn = True
         clonespec.template = False
+        if clone_mode == 'linked':
+            clonespec.snapshot = self.get_base_snapshot(template_vm, resource_pool)
+
+        return template_vm['obj'], folder, clonespec, bool(nic)
+
+    # InstantClone_Task came with vSphere 6.7, the guest reads its settings from guestinfo
+    def instant_clone_spec(self, vm_name, relospec, nic, ip, domain, dns, subnet, gateway):
+        if not hasattr(vim.vm, 'InstantCloneSpec') or not hasattr(vim.VirtualMachine, 'InstantClone'):
+            raise VMwareException('Instant clones need vSphere 6.7 or later, use --linked instead')
+        if nic:
+            relospec.deviceChange = [nic, ]
+
+        guestinfo = {
+            'hostname': vm_name,
+            'domain': domain,
+            'ip': ip,
+            'subnet': subnet,
+            'gateway': gateway,
+            'dns': dns if isinstance(dns, basestring) else ','.join(dns),
+        }
+        clonespec = vim.vm.InstantCloneSpec()
+        clonespec.name = vm_name
+        clonespec.location = relospec
+        clonespec.config = [
+            vim.option.OptionValue(key='guestinfo.kaslan.{}'.format(k), value=v)
+            for k, v in sorted(guestinfo.iteritems())
+        ]
+        return clonespec
+
+    def start_clone(self, template_obj, folder, vm_name, clonespec):
+        if isinstance(clonespec, vim.vm.CloneSpec):
+            return template_obj.Clone(folder=folder, name=vm_name, spec=clonespec)
+        return template_obj.InstantClone(spec=clonespec)
+
+    def find_snapshot(self, snapshots, name):
+        for snapshot in snapshots or ():
+            if snapshot.name == name:
+                return snapshot.snapshot
+            found = self.find_snapshot(snapshot.childSnapshotList, name)
+            if found:
+                return found
+        return None
+
+    # Reuses the template's base snapshot, creating it on first use
+    def get_base_snapshot(self, template_vm, resource_pool):
+        if template_vm.get('snapshot'):
+            snapshot = self.find_snapshot(template_vm['snapshot'].rootSnapshotList, BASE_SNAPSHOT)
+            if snapshot:
+                return snapshot
+
+        with self.snapshot_lock:
+
+            # Another clone may have created it meanwhile
+            current = self.get_props(template_vm['obj'], ('config.template', 'snapshot'))
+            if current.get('snapshot'):
+                snapshot = self.find_snapshot(current['snapshot'].rootSnapshotList, BASE_SNAPSHOT)
+                if snapshot:
+                    return snapshot
+
+            # Templates cannot be snapshotted, turn it into a VM meanwhile
+            vm = template_vm['obj']
+            is_template = current.get('config.template')
+            if is_template:
+                vm.MarkAsVirtualMachine(pool=resource_pool)
+            try:
+                task = vm.CreateSnapshot(
+                    name=BASE_SNAPSHOT,
+                    description='Base for kaslan linked clones',
+                    memory=False,
+                    quiesce=False
+                )
+                created = self.start_task(
+                    task,
+                    task_tag='Snapshot',
+                    success_msg='Created base snapshot {}'.format(BASE_SNAPSHOT),
+                    last_task=False
+                )
+            finally:
+                if is_template:
+                    vm.MarkAsTemplate()
 
-        # Create task
-        task = template_vm['obj'].Clone(folder=folder, name=vm_name, spec=clonespec)
-        result = self.start_task(
-            task,
-            task_tag='Cloning',
-            success_msg='Cloned in folder {}'.format(folder_path),
-            last_task=False
-        )
+            if not created:
+                raise VMwareException('Unable to create base snapshot on template')
+            return task.info.result
 
-        # Do not continue if we didn't get clone
-        if not result:
-            return
+    def index_clone(self, vm_name, task):
+        if self.index:
+            self.index.store(vim.VirtualMachine._wsdlName, vm_name, task.info.result._moId)
 
-        # Change networking
+    # vm skips the lookup by name when the clone task already gave us the new VM
+    def reconfigure_network(self, vm_name, vlan, vm=None):
         vm_props = (
             'runtime.host',
             'config.hardware.device',
         )
-        vm_obj = self.get_obj(obj_names=(vm_name,), prop_names=vm_props)
+        if vm:
+            vm_obj = self.get_props(vm, vm_props)
+        else:
+            vm_obj = self.get_obj(obj_names=(vm_name,), prop_names=vm_props)
         vmconf = vim.vm.ConfigSpec()
 
         # Get right network
-        network = self.get_portgroup(vlan, vm_obj['runtime.host'].name)
+        network = self.get_portgroup(vlan, vm_obj['runtime.host'])
 
         # Modify NIC card
-        nic = vim.vm.device.VirtualDeviceSpec()
-        nic.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
-        for device in vm_obj['config.hardware.device']:
-            if isinstance(device, vim.vm.device.VirtualEthernetCard):
-                nic.device = device
-                break
-        nic.device.wakeOnLanEnabled = True
-        portgroup_connection = vim.dvs.PortConnection()
-        portgroup_connection.portgroupKey = network.key
-        portgroup_connection.switchUuid = network.config.distributedVirtualSwitch.uuid
-        nic.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
-        nic.device.backing.port = portgroup_connection
-        nic.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
-        nic.device.connectable.startConnected = True
-        nic.device.connectable.allowGuestControl = True
+        nic = self.nic_device_change(vm_obj['config.hardware.device'], network)
+        if not nic:
+            raise VMwareException('VM {} has no network card to configure'.format(vm_name))
         vmconf.deviceChange = [nic, ]
 
-        # Start task
-        task = vm_obj['obj'].ReconfigVM_Task(vmconf)
-        self.start_task(
-            task,
-            task_tag='Networking',
-            success_msg='VIF reconfigured'
-        )
+        return vm_obj['obj'].ReconfigVM_Task(vmconf)
 
 
 def wait_for_task(task, *args, **kwargs):
-
-    def no_op(task, *args):
-        pass
-
-    queued_callback = kwargs.get('queued', no_op)
-    running_callback = kwargs.get('running', no_op)
-    success_callback = kwargs.get('success', no_op)
-    error_callback = kwargs.get('error', no_op)
-
-    si = GetSi()
-    pc = si.content.propertyCollector
-
-    obj_spec = [vmodl.query.PropertyCollector.ObjectSpec(obj=task)]
-    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.Task, pathSet=[], all=True)
-    filter_spec = vmodl.query.PropertyCollector.FilterSpec()
-    filter_spec.objectSet = obj_spec
-    filter_spec.propSet = [prop_spec]
-    filter = pc.CreateFilter(filter_spec, True)
-
-    try:
-        version, state = None, None
-
-        # Loop looking for updates till the state moves to a completed state.
-        waiting = True
-        while waiting:
-            update = pc.WaitForUpdates(version)
-            version = update.version
-            for filterSet in update.filterSet:
-                for objSet in filterSet.objectSet:
-                    task = objSet.obj
-                    for change in objSet.changeSet:
-                        if change.name == 'info':
-                            state = change.val.state
-                        elif change.name == 'info.state':
-                            state = change.val
-                        else:
-                            continue
-
-                        if state == vim.TaskInfo.State.success:
-                            success_callback(task, *args)
-                            waiting = False
-
-                        elif state == vim.TaskInfo.State.queued:
-                            queued_callback(task, *args)
-
-                        elif state == vim.TaskInfo.State.running:
-                            running_callback(task, *args)
-
-                        elif state == vim.TaskInfo.State.error:
-                            error_callback(task, *args)
-                            raise task.info.error
-
-    finally:
-        if filter:
-            filter.Destroy()
+    watch = TaskMonitor.for_stub(task._stub).watch(task)
+    return watch.wait(
+        queued=kwargs.get('queued'),
+        running=kwargs.get('running'),
+        success=kwargs.get('success'),
+        error=kwargs.get('error'),
+        progress=kwargs.get('progress'),
+        args=args
+    )
 
 vim.Task.wait = wait_for_task
@@ -0,0 +1,261 @@
+import json
+import os
+import sys
+import threading
+import time
+
+# Active profile, only set with --profile
+_profile = None
+
+# Call in flight on this thread, so connections can add their bytes to it
+_local = threading.local()
+
+# Latency histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+_kaslan_dir = os.path.dirname(os.path.abspath(__file__))
+_callers = {}
+
+
+class CountingResponse(object):
+
+    def __init__(self, resp, counter):
+        self.resp = resp
+        self.counter = counter
+
+    def read(self, *args):
+        data = self.resp.read(*args)
+        self.counter.bytes_received += len(data)
+        call = getattr(_local, 'call', None)
+        if call:
+            call.bytes_received += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.resp, name)
+
+
+class CountingConnection(object):
+
+    def __init__(self, conn, counter):
+        self.conn = conn
+        self.counter = counter
+
+    def request(self, method, url, body=None, headers=None):
+        self.counter.calls += 1
+        self.counter.bytes_sent += len(body or '')
+        call = getattr(_local, 'call', None)
+        if call:
+            call.bytes_sent += len(body or '')
+        return self.conn.request(method, url, body, headers or {})
+
+    def getresponse(self, *args):
+        return CountingResponse(self.conn.getresponse(*args), self.counter)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class WireCounter(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    # Wraps the HTTP connections a pyVmomi SOAP stub hands out
+    def install(self, stub):
+        get_connection = stub.GetConnection
+        return_connection = stub.ReturnConnection
+
+        def counted_get_connection():
+            return CountingConnection(get_connection(), self)
+
+        def counted_return_connection(conn):
+            return_connection(getattr(conn, 'conn', conn))
+
+        stub.GetConnection = counted_get_connection
+        stub.ReturnConnection = counted_return_connection
+
+        # Method calls are recorded when profiling
+        invoke_method = stub.InvokeMethod
+        invoke_accessor = stub.InvokeAccessor
+
+        def profiled_invoke_method(mo, info, args, *rest):
+            profile = _profile
+            if profile is None:
+                return invoke_method(mo, info, args, *rest)
+
+            # Lazy property reads are named after the property
+            method = info.wsdlName
+            accessor = getattr(_local, 'accessor', None)
+            if accessor and method == 'RetrievePropertiesEx':
+                method = 'get {}'.format(accessor)
+                _local.accessor = None
+
+            call = Call(method, calling_stack(), time.time() - profile.start)
+            outer, _local.call = getattr(_local, 'call', None), call
+            try:
+                return invoke_method(mo, info, args, *rest)
+            except Exception as e:
+                call.error = e.__class__.__name__
+                raise
+            finally:
+                call.seconds = time.time() - profile.start - call.offset
+                _local.call = outer
+                profile.add(call)
+
+        def profiled_invoke_accessor(mo, info):
+            if _profile is not None:
+                _local.accessor = '{}.{}'.format(mo._wsdlName, info.name)
+            try:
+                return invoke_accessor(mo, info)
+            finally:
+                _local.accessor = None
+
+        stub.InvokeMethod = profiled_invoke_method
+        stub.InvokeAccessor = profiled_invoke_accessor
+
+    def snapshot(self):
+        return self.calls, self.bytes_sent, self.bytes_received
+
+
+# Kaslan frames making the call as module.function, innermost first
+def calling_stack():
+    stack = []
+    frame = sys._getframe(2)
+    while frame:
+        code = frame.f_code
+        module = _callers.get(code.co_filename)
+        if module is None:
+            path = os.path.splitext(os.path.abspath(code.co_filename))[0]
+            module = ''
+            if path.startswith(_kaslan_dir + os.sep) and path != os.path.join(_kaslan_dir, 'wire'):
+                module = os.path.relpath(path, _kaslan_dir).replace(os.sep, '.')
+            _callers[code.co_filename] = module
+        if module:
+            stack.append('{}.{}'.format(module, code.co_name))
+        frame = frame.f_back
+    return stack
+
+
+# Outermost function in the module that made the call, e.g. vmware.clone rather than the helper below it
+def caller_of(stack):
+    if not stack:
+        return '?'
+    module = stack[0].rsplit('.', 1)[0] + '.'
+    caller = stack[0]
+    for name in stack[1:]:
+        if not name.startswith(module):
+            break
+        caller = name
+    return caller
+
+
+class Call(object):
+
+    def __init__(self, method, stack, offset):
+        self.method = method
+        self.stack = stack
+        self.caller = caller_of(stack)
+        self.offset = offset
+        self.seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.error = None
+        self.thread = threading.current_thread().name
+
+
+class Profile(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def add(self, call):
+        with self.lock:
+            self.calls.append(call)
+
+    # Wall time with at least one call in flight, overlapping calls count once
+    def network_seconds(self):
+        seconds = 0.0
+        end = 0.0
+        for call in sorted(self.calls, key=lambda c: c.offset):
+            call_end = call.offset + call.seconds
+            if call_end > end:
+                seconds += call_end - max(call.offset, end)
+                end = call_end
+        return seconds
+
+    def report(self, top=15, out=None):
+        total = time.time() - self.start
+        network = self.network_seconds()
+        failed = sum(1 for c in self.calls if c.error)
+
+        print >>out, 'SOAP profile:'
+        print >>out, '- {:<10} {}{}'.format('calls', len(self.calls), ' ({} failed)'.format(failed) if failed else '')
+        print >>out, '- {:<10} {}'.format('sent', kilobytes(sum(c.bytes_sent for c in self.calls)))
+        print >>out, '- {:<10} {}'.format('received', kilobytes(sum(c.bytes_received for c in self.calls)))
+        print >>out, '- {:<10} {:.3f}s'.format('network', network)
+        print >>out, '- {:<10} {:.3f}s'.format('python', max(total - network, 0.0))
+        print >>out, '- {:<10} {:.3f}s'.format('total', total)
+        if not self.calls:
+            return
+
+        # Grouped by method and calling function, most time first
+        groups = {}
+        for c in self.calls:
+            group = groups.setdefault((c.method, c.caller), [0, 0.0, 0])
+            group[0] += 1
+            group[1] += c.seconds
+            group[2] += c.bytes_received
+        print >>out, ''
+        print >>out, '{:<36} {:<34} {:>6} {:>9} {:>9} {:>10}'.format('Method', 'Caller', 'Calls', 'Time', 'Avg', 'Received')
+        for (method, caller), (count, seconds, received) in sorted(groups.iteritems(), key=lambda g: -g[1][1])[:top]:
+            print >>out, '{:<36} {:<34} {:>6} {:>8.3f}s {:>7.1f}ms {:>10}'.format(
+                method[:36], caller[:34], count, seconds, seconds / count * 1000, kilobytes(received)
+            )
+        if len(groups) > top:
+            print >>out, '({} more)'.format(len(groups) - top)
+
+        # Latency histogram
+        counts = [0] * (len(BUCKETS) + 1)
+        for c in self.calls:
+            counts[sum(1 for b in BUCKETS if c.seconds >= b)] += 1
+        widest = max(counts)
+        print >>out, ''
+        print >>out, 'Latency:'
+        for i, count in enumerate(counts):
+            label = '< {}ms'.format(int(BUCKETS[i] * 1000)) if i < len(BUCKETS) else '>= {}ms'.format(int(BUCKETS[-1] * 1000))
+            print >>out, '- {:<9} {:>6} {}'.format(label, count, '#' * int(round(40.0 * count / widest)))
+
+    # One JSON object per call, in start order
+    def write_trace(self, path):
+        with open(path, 'w') as f:
+            for c in sorted(self.calls, key=lambda c: c.offset):
+                f.write(json.dumps({
+                    'offset': round(c.offset, 6),
+                    'seconds': round(c.seconds, 6),
+                    'method': c.method,
+                    'caller': c.caller,
+                    'stack': c.stack,
+                    'thread': c.thread,
+                    'bytes_sent': c.bytes_sent,
+                    'bytes_received': c.bytes_received,
+                    'error': c.error,
+                }, sort_keys=True) + '\n')
+
+
+def kilobytes(count):
+    return '{:.1f}KB'.format(count / 1024.0)
+
+
+def start_profile():
+    global _profile
+    _profile = Profile()
+    return _profile
+
+
+def get_profile():
+    return _profile
@@ -8,6 +8,7 @@ setup(
     install_requires=[
         'PyYAML',
         'argparse',
+        'futures',
         'netaddr',
         'tzlocal',
         'pyvmomi==5.5.0.2014.1.1',